@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import argparse
+import concurrent.futures
+import http.server
+import json
+import os
+import ssl
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+
+
+BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.pardir)
+sys.path.insert(0, BASE)
+
+from clients import config as cfg  # noqa: E402
+from clients import session  # noqa: E402
+
+
+def parse_args(raw_args):
+    parser = argparse.ArgumentParser(
+        raw_args[0], description='Measure config API calls made with '
+                                 'urlopen per call and with the pooled '
+                                 'session. Runs a local config service '
+                                 'unless --url is given')
+    parser.add_argument(
+        '-n', metavar='NUM', type=int, default=500,
+        help='Number of calls of every case')
+    parser.add_argument(
+        '--threads', metavar='NUM', type=int, nargs='+', default=[1, 8],
+        help='Numbers of threads making the calls')
+    parser.add_argument(
+        '--url', help='Base URL of a config service to call instead')
+    parser.add_argument(
+        '--entity', default='host', help='Entity to get from --url')
+    parser.add_argument(
+        '--cert', metavar='FILE',
+        help='Certificate with its key, serves the local config service '
+             'over TLS, which is what makes handshakes costly')
+    return parser.parse_args(raw_args[1:])
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written apart, delayed ACKs would stall them.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = json.dumps({'name': self.path.strip('/'), 'props': {}})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(cert):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    scheme = 'http'
+    if cert:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = 'https'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return '{}://127.0.0.1:{}'.format(scheme, server.server_port)
+
+
+def urlopen_get(base_url, entity):
+    reply = urllib.request.urlopen(f'{base_url}/{entity}')
+    result = json.load(reply)
+    reply.close()
+    return result
+
+
+def measure(get, base_url, entity, calls, threads):
+    def call(_):
+        start = time.perf_counter()
+        get(base_url, entity)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        times = list(executor.map(call, range(calls)))
+    wall = time.perf_counter() - start
+    times.sort()
+    return {
+        'calls/s': calls / wall,
+        'med, ms': statistics.median(times) * 1000,
+        'p95, ms': times[int(len(times) * 0.95)] * 1000,
+    }
+
+
+def main(raw_args):
+    args = parse_args(raw_args)
+    base_url = args.url or serve(args.cert)
+    if args.cert and not args.url:
+        # The local certificate is self-signed.
+        ssl._create_default_https_context = ssl._create_unverified_context
+        session.Session.context = ssl._create_unverified_context()
+
+    print('{:<10} {:>8} {:>10} {:>9} {:>9} {:>12}'.format(
+        'client', 'threads', 'calls/s', 'med, ms', 'p95, ms', 'connections'))
+    for threads in args.threads:
+        for name, get in (('urlopen', urlopen_get), ('session', cfg.get)):
+            session.shared().clear()
+            session.shared().connections = 0
+            result = measure(get, base_url, args.entity, args.n, threads)
+            connections = (session.shared().connections if name == 'session'
+                           else args.n)
+            print('{:<10} {:>8} {:>10.0f} {:>9.2f} {:>9.2f} {:>12}'.format(
+                name, threads, result['calls/s'], result['med, ms'],
+                result['p95, ms'], connections), flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
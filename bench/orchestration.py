@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+
+
+BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.pardir)
+
+COMMON_ARGS = ['-l', '127.0.0.1', '-n', '/dev/null:/dev/null']
+
+# The credentials file is only accepted by methods with AMT stages.
+METHOD_ARGS = {
+    'amt': lambda creds: ['-p', creds] + COMMON_ARGS,
+    'simple': lambda creds: COMMON_ARGS,
+}
+
+
+def parse_args(raw_args):
+    parser = argparse.ArgumentParser(
+        raw_args[0], description='Measure orchestration overhead of deploy '
+                                 'methods with simulated hosts. Arguments '
+                                 'after -- are passed to main.py')
+    parser.add_argument(
+        '--sizes', metavar='NUM', type=int, nargs='+',
+        default=[10, 100, 1000, 5000], help='Numbers of hosts to deploy')
+    parser.add_argument(
+        '--methods', metavar='METHOD', nargs='+', choices=sorted(METHOD_ARGS),
+        default=sorted(METHOD_ARGS), help='Methods to deploy with')
+    parser.add_argument(
+        '--sim', metavar='ARG', action='append', default=[],
+        help='Extra argument for the simulation, e.g. '
+             '"--latency=ssh=0.05:0.01"')
+    parser.add_argument(
+        '--json', metavar='FILE', help='Write the results as JSON into FILE')
+    parser.add_argument('args', nargs=argparse.REMAINDER)
+    args = parser.parse_args(raw_args[1:])
+    if args.args[:1] == ['--']:
+        args.args = args.args[1:]
+    return args
+
+
+def sample(process, peak):
+    try:
+        tree = [process] + process.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return
+    rss = 0
+    for member in tree:
+        try:
+            rss += member.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    peak['processes'] = max(peak['processes'], len(tree))
+    peak['rss'] = max(peak['rss'], rss)
+
+
+def measure(method, hosts, sim_args, extra_args, creds):
+    cmdline = ([sys.executable, '-m', 'sim', '--hosts', str(hosts)] +
+               sim_args + ['--', '-m', method] +
+               METHOD_ARGS[method](creds) + extra_args)
+    peak = {'processes': 0, 'rss': 0}
+    start = time.time()
+    child = subprocess.Popen(cmdline, cwd=BASE, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL)
+    process = psutil.Process(child.pid)
+    while child.poll() is None:
+        sample(process, peak)
+        time.sleep(0.05)
+    return {
+        'method': method,
+        'hosts': hosts,
+        'rv': child.returncode,
+        'wall': time.time() - start,
+        'peak_rss_mb': peak['rss'] / 2 ** 20,
+        'peak_processes': peak['processes'],
+    }
+
+
+def main(raw_args):
+    args = parse_args(raw_args)
+    results = []
+    print('{:<8} {:>6} {:>4} {:>9} {:>13} {:>10}'.format(
+        'method', 'hosts', 'rv', 'wall, s', 'peak RSS, MB', 'processes'))
+    with tempfile.NamedTemporaryFile('w', prefix='dg_bench_') as creds:
+        creds.write('sim:sim\n')
+        creds.flush()
+        for method in args.methods:
+            for hosts in args.sizes:
+                result = measure(method, hosts, args.sim, args.args,
+                                 creds.name)
+                results.append(result)
+                print('{method:<8} {hosts:>6} {rv:>4} {wall:>9.2f} '
+                      '{peak_rss_mb:>13.1f} {peak_processes:>10}'.format(
+                          **result), flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
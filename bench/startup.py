@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.pardir)
+
+CASES = [
+    ['--help'],
+    ['-m', 'amt', '-s'],
+    ['-m', 'simple', '-s'],
+    ['-m', 'stdm', '-s'],
+]
+
+
+def parse_args(raw_args):
+    parser = argparse.ArgumentParser(
+        raw_args[0], description='Measure start up time of main.py. '
+                                 'Arguments after -- replace the default '
+                                 'cases with a single one')
+    parser.add_argument(
+        '-n', metavar='NUM', type=int, default=20,
+        help='Number of runs of every case')
+    parser.add_argument(
+        '--imports', metavar='NUM', type=int, default=0,
+        help='Show NUM slowest top level imports of every case')
+    parser.add_argument('args', nargs=argparse.REMAINDER)
+    args = parser.parse_args(raw_args[1:])
+    if args.args[:1] == ['--']:
+        args.args = args.args[1:]
+    return args
+
+
+def run(args, options=()):
+    return subprocess.run(
+        [sys.executable] + list(options) + ['main.py'] + args, cwd=BASE,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+
+def slowest_imports(args, count):
+    imports = []
+    for line in run(args, ['-X', 'importtime']).stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Only top level imports, nested ones are included in those.
+        if cumulative.strip().isdigit() and not name[1:].startswith(' '):
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main(raw_args):
+    args = parse_args(raw_args)
+    print('{:<40} {:>9} {:>9}'.format('arguments', 'min, ms', 'med, ms'))
+    for case in [args.args] if args.args else CASES:
+        times = []
+        for _ in range(args.n):
+            start = time.perf_counter()
+            run(case)
+            times.append(time.perf_counter() - start)
+        print('{:<40} {:>9.1f} {:>9.1f}'.format(
+            ' '.join(case), min(times) * 1000,
+            statistics.median(times) * 1000), flush=True)
+        for cumulative, name in slowest_imports(case, args.imports):
+            print('    {:<36} {:>9.1f}'.format(name, cumulative / 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
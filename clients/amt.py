@@ -0,0 +1,245 @@
+import functools
+import hashlib
+import os
+import threading
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree as ElementTree
+
+from . import session
+
+
+PORT = 16992
+SERVICE = '/RemoteControlService'
+NAMESPACE = 'http://schemas.intel.com/platform/client/RemoteControl/2004/01'
+SOAP_NAMESPACE = 'http://schemas.xmlsoap.org/soap/envelope/'
+
+POWER_STATES = ('S0', 'S1', 'S2', 'S3', 'S4', 'S5 (soft-off)', 'S4/S5', 'Off')
+S0 = 0
+S5 = 5
+OFF = 7
+
+COMMANDS = {
+    'reset': 16,
+    'powerup': 17,
+    'powerdown': 18,
+    'powercycle': 19,
+}
+
+SPECIAL_COMMANDS = {
+    'nop': 0,
+    'pxe': 1,
+    'hd': 2,
+    'hdsafe': 3,
+    'diag': 4,
+    'cd': 5,
+}
+
+OEM_SPECIAL_COMMANDS = {
+    'bios': 0xc1,
+}
+
+# Intel.
+IANA_OEM_NUMBER = 343
+
+# Hosts asked at once by power_states.
+CONCURRENCY = 32
+
+# incomplete list
+STATUSES = {
+    0x0: 'success',
+    0x1: 'internal error',
+    0x3: 'invalid pt_mode',
+    0xc: 'invalid name',
+    0xf: 'invalid byte_count',
+    0x10: 'not permitted',
+    0x17: 'max limit_reached',
+    0x18: 'invalid auth_type',
+    0x1a: 'invalid dhcp_mode',
+    0x1b: 'invalid ip_address',
+    0x1c: 'invalid domain_name',
+    0x20: 'invalid provisioning_state',
+    0x22: 'invalid time',
+    0x23: 'invalid index',
+    0x24: 'invalid parameter',
+    0x25: 'invalid netmask',
+    0x26: 'flash write_limit_exceeded',
+    0x800: 'network if_error_base',
+    0x801: 'unsupported oem_number',
+    0x802: 'unsupported boot_option',
+    0x803: 'invalid command',
+    0x804: 'invalid special_command',
+    0x805: 'invalid handle',
+    0x806: 'invalid password',
+    0x807: 'invalid realm',
+    0x808: 'storage acl_entry_in_use',
+    0x809: 'data missing',
+    0x80a: 'duplicate',
+    0x80b: 'eventlog frozen',
+    0x80c: 'pki missing_keys',
+    0x80d: 'pki generating_keys',
+    0x80e: 'invalid key',
+    0x80f: 'invalid cert',
+    0x810: 'cert key_not_match',
+    0x811: 'max kerb_domain_reached',
+    0x812: 'unsupported',
+    0x813: 'invalid priority',
+    0x814: 'not found',
+    0x815: 'invalid credentials',
+    0x816: 'invalid passphrase',
+    0x818: 'no association',
+}
+
+
+class AMTError(Exception):
+    '''AMT host answered with a status other than success.'''
+
+    def __init__(self, host, status):
+        super(AMTError, self).__init__(host, status)
+        self.host = host
+        self.status = status
+
+    def __str__(self):
+        message = STATUSES.get(
+            self.status, 'unknown pt_status code: 0x{:x}'.format(self.status))
+        return '{}: {}'.format(self.host, message)
+
+
+def md5(*fields):
+    return hashlib.md5(':'.join(fields).encode()).hexdigest()
+
+
+class Digest(object):
+    '''Digest authentication with an AMT host, which its requests reuse
+    until the host asks for a new one.'''
+
+    def __init__(self, user, password):
+        self.user = user
+        self.password = password
+        self.challenge = None
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def update(self, challenge):
+        fields = urllib.request.parse_keqv_list(
+            urllib.request.parse_http_list(challenge.split(' ', 1)[1]))
+        with self.lock:
+            self.challenge = fields
+            self.count = 0
+
+    def header(self, method, uri):
+        with self.lock:
+            if self.challenge is None:
+                return None
+            challenge = self.challenge
+            self.count += 1
+            count = '{:08x}'.format(self.count)
+        realm, nonce = challenge['realm'], challenge['nonce']
+        qops = [qop.strip() for qop in challenge.get('qop', '').split(',')]
+        cnonce = os.urandom(8).hex()
+        secret = md5(self.user, realm, self.password)
+        if 'auth' in qops:
+            response = md5(secret, nonce, count, cnonce, 'auth',
+                           md5(method, uri))
+        else:
+            response = md5(secret, nonce, md5(method, uri))
+
+        fields = [('username', self.user), ('realm', realm),
+                  ('nonce', nonce), ('uri', uri), ('response', response)]
+        if 'opaque' in challenge:
+            fields.append(('opaque', challenge['opaque']))
+        header = 'Digest ' + ', '.join(
+            '{}="{}"'.format(name, value) for name, value in fields)
+        if 'auth' in qops:
+            header += ', qop=auth, nc={}, cnonce="{}"'.format(count, cnonce)
+        return header
+
+
+# Requests are retried by stages, SOAP faults should not be repeated here.
+_session = session.Session(retries=0)
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def _digest(host, user, password):
+    with _digests_lock:
+        key = (host, user, password)
+        if key not in _digests:
+            _digests[key] = Digest(user, password)
+        return _digests[key]
+
+
+def envelope(method, params=()):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<soap:Envelope xmlns:soap="{}"><soap:Body>'
+        '<{} xmlns="{}">{}</{}>'
+        '</soap:Body></soap:Envelope>'.format(
+            SOAP_NAMESPACE, method, NAMESPACE,
+            ''.join('<{0}>{1}</{0}>'.format(name, value)
+                    for name, value in params),
+            method)).encode()
+
+
+def _call(host, credentials, method, params=(), idempotent=False):
+    '''Calls method of RemoteControlService on host, returns the values
+    in its response after the status. Only idempotent methods are sent
+    again on connections the host closed meanwhile.'''
+    url = 'http://{}:{}{}'.format(host, PORT, SERVICE)
+    headers = {
+        'Content-Type': 'text/xml; charset=utf-8',
+        'SOAPAction': '"{}#{}"'.format(NAMESPACE, method),
+    }
+    digest = _digest(host, *credentials)
+    body = envelope(method, params)
+    for attempt in range(2):
+        authorization = digest.header('POST', SERVICE)
+        if authorization:
+            headers['Authorization'] = authorization
+        try:
+            reply = _session.request(url, body, headers, idempotent)
+            break
+        except urllib.error.HTTPError as e:
+            challenge = e.headers.get('WWW-Authenticate', '')
+            # A stale nonce is answered with a new challenge once.
+            if e.code != 401 or not challenge.startswith('Digest') \
+                    or attempt:
+                raise
+            digest.update(challenge)
+
+    response = ElementTree.fromstring(reply).find(
+        './/{{{}}}{}Response'.format(NAMESPACE, method))
+    if response is None:
+        raise ValueError(f'{host}: no {method}Response in reply')
+    status, *values = [int(child.text) for child in response]
+    if status != 0:
+        raise AMTError(host, status)
+    return values
+
+
+def power_state(host, credentials):
+    '''Returns the power state of host, S0 if it is on.'''
+    state, = _call(host, credentials, 'GetSystemPowerState',
+                   idempotent=True)
+    return state & 0x0f
+
+
+def power_states(credentials, errors=None):
+    '''Gets power states of hosts at once, credentials are mapped by host.
+    Returns the states by host, fails like session.at_once.'''
+    return session.at_once(
+        dict((host, functools.partial(power_state, host, credentials_))
+             for host, credentials_ in credentials.items()),
+        errors, CONCURRENCY)
+
+
+def remote_control(host, credentials, command, special=None):
+    '''Runs command, e.g. powerup, optionally booting into special.'''
+    params = [('Command', COMMANDS[command]),
+              ('IanaOemNumber', IANA_OEM_NUMBER)]
+    if special in SPECIAL_COMMANDS:
+        params.append(('SpecialCommand', SPECIAL_COMMANDS[special]))
+    if special in OEM_SPECIAL_COMMANDS:
+        params.append(('SpecialCommand', OEM_SPECIAL_COMMANDS[special]))
+        params.append(('OEMparameters', 1))
+    _call(host, credentials, 'RemoteControl', params)
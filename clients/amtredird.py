@@ -1,7 +1,12 @@
 import json
-import urllib.error
+import threading
 import urllib.parse
-import urllib.request
+
+from . import session
+
+
+# Result of clients amtredird did not report.
+MISSING = (-1, 'no result from amtredird')
 
 
 class AmtredirdError(Exception):
@@ -14,12 +19,10 @@ class AmtredirdError(Exception):
 
 
 def _do(base_url, cmd, data=None):
-    reply = urllib.request.urlopen(
+    result = json.loads(session.shared().request(
         f'{base_url}/{cmd}',
         data.encode() if data is not None else None
-    )
-    result = json.load(reply)
-    reply.close()
+    ))
     if 'error' in result:
         raise AmtredirdError(result['error'])
     return result
@@ -30,15 +33,26 @@ def _list(clients):
 
 
 def _post(base_url, cmd, clients):
+    '''Returns result and args by client, MISSING for ones not reported.'''
+    if not clients:
+        return {}
     result = _do(base_url, cmd, _list(clients))
-    assert len(result) == len(clients)
-    return result
+    return dict((client, tuple(result.get(client, MISSING)))
+                for client in clients)
+
+
+# Clients of amtredird by URL, they do not change during a run.
+_clients = {}
+_clients_lock = threading.Lock()
 
 
 def list(base_url):
-    result = _do(base_url, 'list')
-    assert len(result) == 2 and result[0] == 0
-    return result[1]
+    with _clients_lock:
+        if base_url not in _clients:
+            result = _do(base_url, 'list')
+            assert len(result) == 2 and result[0] == 0
+            _clients[base_url] = result[1]
+        return _clients[base_url]
 
 
 def start(base_url, clients):
@@ -47,3 +61,12 @@ def start(base_url, clients):
 
 def stop(base_url, clients):
     return _post(base_url, 'stop', clients)
+
+
+def restart(base_url, clients):
+    '''Stops redirection of clients, starts it again for the ones stopped.
+    Returns the results of the last command of each client.'''
+    results = stop(base_url, clients)
+    stopped = [client for client in clients if results[client][0] == 0]
+    results.update(start(base_url, stopped))
+    return results
@@ -1,18 +1,164 @@
+import collections
+import functools
+import hashlib
 import json
+import os
+import tempfile
+import threading
+import time
 import urllib.error
 import urllib.parse
-import urllib.request
+
+from . import session
+
+
+# Concurrent requests of get_many, no more than the idle connections kept.
+CONCURRENCY = session.Session.MAX_IDLE
+
+
+class Cache(object):
+    '''Entities kept on disk between runs.
+
+    Entities younger than ttl are used as they are, older ones are
+    revalidated with ETag and If-Modified-Since. If the config API fails,
+    entities up to max_stale old are used instead. Hosts are always
+    revalidated, as their props, e.g. boot, change between runs.'''
+
+    MAX_STALE = 24 * 3600
+
+    def __init__(self, directory, ttl, max_stale=MAX_STALE):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.counters = collections.Counter()
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def summary(self):
+        return ', '.join('{} {}'.format(self.counters[name], name)
+                         for name in ('hits', 'revalidated', 'misses',
+                                      'stale', 'invalidated'))
+
+    def path(self, base_url, entity):
+        return os.path.join(
+            self.directory, hashlib.sha1(base_url.encode()).hexdigest(),
+            urllib.parse.quote(entity, safe=''))
+
+    def load(self, base_url, entity):
+        try:
+            with open(self.path(base_url, entity)) as cached:
+                return json.load(cached)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, base_url, entity, entry):
+        path = self.path(base_url, entity)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                    'w', dir=os.path.dirname(path), delete=False) as temp:
+                json.dump(entry, temp)
+            os.replace(temp.name, path)
+        except OSError:
+            # The cache only saves requests, the run goes on without it.
+            pass
+
+    def invalidate(self, base_url, entity):
+        try:
+            os.unlink(self.path(base_url, entity))
+        except OSError:
+            return
+        self.count('invalidated')
+
+    @staticmethod
+    def trusted(entry):
+        return 'props' not in entry['value']
+
+    def get(self, base_url, entity):
+        entry = self.load(base_url, entity)
+        age = time.time() - entry['time'] if entry else None
+        if entry and 0 <= age < self.ttl and Cache.trusted(entry):
+            self.count('hits')
+            return entry['value']
+
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('modified'):
+            headers['If-Modified-Since'] = entry['modified']
+        try:
+            status, reply_headers, body = session.shared().open(
+                f'{base_url}/{entity}', headers=headers)
+        except OSError as e:
+            # Entities the config API does not have are not used either.
+            missing = isinstance(e, urllib.error.HTTPError) and e.code < 500
+            if entry and age < self.max_stale and not missing \
+                    and Cache.trusted(entry):
+                self.count('stale')
+                return entry['value']
+            raise
+
+        if status == 304 and entry:
+            self.count('revalidated')
+        else:
+            self.count('misses')
+            entry = {
+                'value': json.loads(body),
+                'etag': reply_headers.get('ETag'),
+                'modified': reply_headers.get('Last-Modified'),
+            }
+        entry['time'] = time.time()
+        self.store(base_url, entity, entry)
+        return entry['value']
+
+
+# Cache of the process, entities are not cached unless it is set.
+cache = None
+
+
+def use_cache(directory, ttl):
+    global cache
+    if cache is None or (cache.directory, cache.ttl) != (directory, ttl):
+        cache = Cache(directory, ttl)
 
 
 def get(base_url, entity):
-    reply = urllib.request.urlopen(f'{base_url}/{entity}')
-    result = json.load(reply)
-    reply.close()
-    return result
+    if cache is not None:
+        return cache.get(base_url, entity)
+    return json.loads(session.shared().request(f'{base_url}/{entity}'))
+
+
+def get_many(base_url, entities, errors=None):
+    '''Gets entities at once, returns them by name.
+
+    Raises the error of the first entity failed, unless errors dict is
+    given, which gets the errors by name instead.'''
+    # The module defines its own set.
+    return session.at_once(
+        dict((entity, functools.partial(get, base_url, entity))
+             for entity in sorted(frozenset(entities))),
+        errors, CONCURRENCY)
+
+
+def set_many(base_url, props, errors=None):
+    '''Sets props of entities at once, props are mapped by entity name.
+    Returns names of the entities set, fails like get_many. Cached entries
+    of all the entities are dropped, even of the ones failed.'''
+    return list(session.at_once(
+        dict((entity, functools.partial(set, base_url, entity, props_))
+             for entity, props_ in sorted(props.items())),
+        errors, CONCURRENCY))
 
 
 def set(base_url, entity, props):
-    urllib.request.urlopen(
-        f'{base_url}/{entity}',
-        urllib.parse.urlencode(props).encode()
-    ).close()
+    try:
+        session.shared().request(
+            f'{base_url}/{entity}',
+            urllib.parse.urlencode(props).encode())
+    finally:
+        # Even a failed request could have changed the entity.
+        if cache is not None:
+            cache.invalidate(base_url, entity)
@@ -0,0 +1,232 @@
+import concurrent.futures
+import http.client
+import io
+import os
+import select
+import threading
+import time
+import urllib.error
+import urllib.parse
+import weakref
+
+
+# Redirects followed, like by urllib.request.HTTPRedirectHandler.
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+class NotSentError(urllib.error.URLError):
+    '''Connecting to the server failed, so it did not get the request.'''
+
+
+class Session(object):
+    '''Pool of keep-alive HTTP connections, shared by the threads.
+
+    Failed connections, timeouts and 5xx replies are retried, unless the
+    request is a POST not marked idempotent. Errors are raised as
+    urllib.error ones, like urllib.request.urlopen does. Unlike urlopen,
+    it connects to the servers directly, ignoring *_proxy environment
+    variables, as the services it talks to are in the deployment
+    network.'''
+
+    TIMEOUT = 30
+    RETRIES = 3
+    BACKOFF = 0.5
+    MAX_IDLE = 16
+    MAX_REDIRECTS = 10
+    # SSL context of HTTPS connections, the default one if None.
+    context = None
+
+    def __init__(self, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        _sessions.add(self)
+
+    def clear(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def forget(self):
+        '''Drops the connections without closing them, the parent process
+        still uses them after fork.'''
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def take(self, key):
+        with self.lock:
+            self.requests += 1
+        while True:
+            with self.lock:
+                connections = self.idle.get(key)
+                if not connections:
+                    self.connections += 1
+                    break
+                connection = connections.pop()
+            # An idle connection with anything to read was closed by the
+            # server.
+            if not select.select([connection.sock], [], [], 0)[0]:
+                return connection, True
+            connection.close()
+        scheme, netloc = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(
+                netloc, timeout=self.timeout, context=self.context), False
+        return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def give_back(self, key, connection):
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < Session.MAX_IDLE:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def send(self, key, method, path, body, headers, idempotent=False):
+        '''Returns status, reason, headers and body of the reply.
+
+        Raises NotSentError if connecting to the server failed.'''
+        while True:
+            connection, reused = self.take(key)
+            if not reused:
+                try:
+                    connection.connect()
+                except OSError as e:
+                    connection.close()
+                    raise NotSentError(e)
+            # The server could close an idle connection any time, which
+            # shows before it replied anything.
+            dropped = (ConnectionResetError, BrokenPipeError)
+            try:
+                connection.request(method, path, body, headers)
+                dropped = http.client.RemoteDisconnected
+                reply = connection.getresponse()
+                data = reply.read()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                if reused and idempotent and isinstance(e, dropped):
+                    continue
+                raise
+            if reply.will_close:
+                connection.close()
+            else:
+                self.give_back(key, connection)
+            return reply.status, reply.reason, reply.headers, data
+
+    def request(self, url, data=None, headers=None, idempotent=False):
+        '''Sends GET, or POST if data is given, returns the reply body.'''
+        return self.open(url, data, headers, idempotent)[2]
+
+    def open(self, url, data=None, headers=None, idempotent=False):
+        '''Like request, returns status, headers and body of the reply.
+
+        Redirects are followed like urlopen does: POST is sent again as
+        GET after 301, 302 and 303, and is not redirected after 307 and
+        308.'''
+        for redirects in range(Session.MAX_REDIRECTS + 1):
+            status, reason, reply_headers, body = self.fetch(
+                url, data, headers, idempotent)
+            location = reply_headers.get('Location')
+            if status not in REDIRECTS or location is None:
+                break
+            if (status in (307, 308) and data is not None) \
+                    or redirects == Session.MAX_REDIRECTS:
+                break
+            url = urllib.parse.urljoin(url, location)
+            data = None
+        if status >= 300 and status != 304:
+            raise urllib.error.HTTPError(
+                url, status, reason, reply_headers, io.BytesIO(body))
+        return status, reply_headers, body
+
+    def fetch(self, url, data, headers, idempotent):
+        '''Sends a single request, retrying GET, and POST if idempotent.
+        POST is retried otherwise only if connecting failed, so that the
+        server could not have got it.'''
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = urllib.parse.urlunsplit(('', '', parts.path or '/',
+                                        parts.query, ''))
+        method = 'GET' if data is None else 'POST'
+        idempotent = idempotent or method == 'GET'
+        headers = dict(headers or {})
+        if data is not None:
+            headers.setdefault('Content-Type',
+                               'application/x-www-form-urlencoded')
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                status, reason, reply_headers, body = self.send(
+                    key, method, path, data, headers, idempotent)
+            except (OSError, http.client.HTTPException) as e:
+                if not idempotent and not isinstance(e, NotSentError):
+                    raise urllib.error.URLError(e)
+                error = e
+                continue
+            if status >= 500 and idempotent:
+                error = urllib.error.HTTPError(
+                    url, status, reason, reply_headers, io.BytesIO(body))
+                continue
+            if status >= 400:
+                raise urllib.error.HTTPError(
+                    url, status, reason, reply_headers, io.BytesIO(body))
+            return status, reason, reply_headers, body
+        if isinstance(error, urllib.error.URLError):
+            raise error
+        raise urllib.error.URLError(error)
+
+
+def at_once(calls, errors=None, concurrency=Session.MAX_IDLE):
+    '''Runs calls mapped by name in up to concurrency threads, returns
+    their results by name.
+
+    Raises the error of the first call failed, unless errors dict is
+    given, which gets the errors by name instead.'''
+    if not calls:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(
+            min(len(calls), concurrency)) as executor:
+        futures = [(name, executor.submit(call))
+                   for name, call in calls.items()]
+    results = {}
+    for name, future in futures:
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            if errors is None:
+                raise
+            errors[name] = e
+    return results
+
+
+_session = None
+_session_lock = threading.Lock()
+# All the sessions of the process, which forked children drop.
+_sessions = weakref.WeakSet()
+
+
+def shared():
+    '''Returns the session of the process.'''
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = Session()
+        return _session
+
+
+def _after_fork():
+    global _session_lock
+    _session_lock = threading.Lock()
+    for session in _sessions:
+        session.forget()
+
+
+os.register_at_fork(after_in_child=_after_fork)
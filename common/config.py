@@ -1,11 +1,19 @@
 import argparse
 import contextlib
+import importlib
 import json
 import sys
 
+from . import executor
+from . import journal
+from . import limits
 from . import log
+from . import method as method_
+from . import shard
 from . import stage
 from . import state
+from . import timing
+from clients import config as cfg
 from util import amt_creds, proc, lock
 
 
@@ -31,6 +39,56 @@ def get_args(raw_args):
         return raw_args[1:]
 
 
+class LazyMethod(object):
+    '''Deploy method, which module is imported only once it is chosen.'''
+
+    def __init__(self, name, module, cls):
+        self.name = name
+        self.module = module
+        self.cls = cls
+
+    def load(self):
+        return getattr(importlib.import_module(self.module), self.cls)
+
+
+class Parser(argparse.ArgumentParser):
+    '''With raising, raises ValueError with the usage or help message
+    instead of printing it and exiting, e.g. to check options of other
+    processes from any thread.'''
+
+    def __init__(self, *args, raising=False, **kwargs):
+        super(Parser, self).__init__(*args, **kwargs)
+        self.raising = raising
+
+    def error(self, message):
+        if not self.raising:
+            super(Parser, self).error(message)
+        raise ValueError('{}{}: error: {}'.format(
+            self.format_usage(), self.prog, message))
+
+    def print_help(self, file=None):
+        if not self.raising:
+            return super(Parser, self).print_help(file)
+        raise ValueError(self.format_help().strip())
+
+
+class MethodsParser(Parser):
+    '''Describes the methods only when asked for help, as that needs all of
+    them loaded.'''
+
+    def __init__(self, methods, raising=False):
+        super(MethodsParser, self).__init__(
+            formatter_class=argparse.RawTextHelpFormatter, raising=raising)
+        self.methods = methods
+
+    def format_help(self):
+        self.description = 'Deploy some machines. Available methods are:\n'
+        for method in self.methods:
+            self.description += '  {:<8} {}\n'.format(
+                method.name, method.load().__doc__)
+        return super(MethodsParser, self).format_help()
+
+
 def execute_with(raw_args, methods):
     args = get_args(raw_args)
     method_cls, stages = Option.choose_method_and_stages(methods, args)
@@ -38,24 +96,48 @@ def execute_with(raw_args, methods):
     if stages == []:
         print(f'Stages of "{method_cls.name}" method:', file=sys.stderr)
         for index, stage_ in enumerate(method_cls.stages):
-            print('{:-3d}: {}'.format(index, stage_), file=sys.stderr)
+            after = ''
+            if index in method_cls.dependencies:
+                after = ' (after {})'.format(', '.join(
+                    map(str, method_cls.dependencies[index])))
+            print('{:-3d}: {}{}'.format(index, stage_, after),
+                  file=sys.stderr)
         return 0
 
     method = method_cls(stages)
     parser = Option.get_method_parser(method, args)
     method_args = parser.parse_args(args)
+    if method_args.shard and method_args.resume:
+        parser.error('--resume is not supported with --shard')
 
     method.parse(method_args)
 
     the_state = state.State(parser, method_args)
     with contextlib.ExitStack() as stack:
+        the_state.timings = timing.Timings(method)
         stack.enter_context(log.capturing(method_args, the_state))
+        stack.enter_context(timing.exporting(method_args, the_state))
+        the_state.executor = stack.enter_context(
+            executor.running(method_args))
+        the_state.journal = stack.enter_context(
+            journal.opened(method_args, method))
+        the_state.limiter = limits.make(method_args)
+        stack.callback(log_config_cache, the_state)
         if method_args.lock:
             for lock_file in sorted(method_args.lock):
                 stack.enter_context(lock.locked(the_state, lock_file))
+        if method_args.shard:
+            coordinator = shard.Coordinator(
+                the_state, method, args, method_args)
+            return 0 if coordinator.run(method_args.shard) else 1
         return 0 if method.run(the_state) else 1
 
 
+def log_config_cache(state):
+    if cfg.cache is not None:
+        state.log.info('config cache: {}'.format(cfg.cache.summary()))
+
+
 class Option(object):
     requirements = []
     EMPTY = ()
@@ -68,8 +150,14 @@ class Option(object):
         return rv
 
     @staticmethod
-    def add_common_params(parser, method_classes):
+    def add_common_params(parser, methods):
         state.State.add_params(parser)
+        method_.Method.add_params(parser)
+        executor.add_params(parser)
+        journal.add_params(parser)
+        limits.add_params(parser)
+        shard.add_params(parser)
+        timing.add_params(parser)
         log.add_params(parser)
         parser.add_argument(
             '--lock', type=lock.lock, nargs='+',
@@ -78,7 +166,7 @@ class Option(object):
                  '",r" to file name'
         )
         parser.add_argument(
-            '-m', choices=[method.name for method in method_classes],
+            '-m', choices=[method.name for method in methods],
             help='Deploy method', required=True)
         parser.add_argument(
             '-s', nargs='*', default=None, metavar='NUM',
@@ -99,22 +187,17 @@ class Option(object):
         return stages
 
     @staticmethod
-    def choose_method_and_stages(method_classes, raw_args):
-        names = dict((m.name, m) for m in method_classes)
-        description = 'Deploy some machines. Available methods are:\n'
-        for method in method_classes:
-            description += '  {:<8} {}\n'.format(method.name, method.__doc__)
-        parser = argparse.ArgumentParser(
-            description=description,
-            formatter_class=argparse.RawTextHelpFormatter)
-        Option.add_common_params(parser, method_classes)
+    def choose_method_and_stages(methods, raw_args, raising=False):
+        names = dict((m.name, m) for m in methods)
+        parser = MethodsParser(methods, raising)
+        Option.add_common_params(parser, methods)
         Option.add_all(parser)
         args = parser.parse_args(raw_args)
-        return names[args.m], Option.get_stages(args.s)
+        return names[args.m].load(), Option.get_stages(args.s)
 
     @staticmethod
-    def get_method_parser(method, raw_args):
-        parser = argparse.ArgumentParser(description=method.__doc__)
+    def get_method_parser(method, raw_args, raising=False):
+        parser = Parser(description=method.__doc__, raising=raising)
         Option.add_common_params(parser, [type(method)])
         Option.add_required(parser, method)
         return parser
@@ -155,10 +238,18 @@ class WithAMTRedirdURL(stage.Stage):
 
 @Option.requires('-c', help='config API url', metavar='CONFIG',
                  default='https://urgu.org/config')
+@Option.requires('--config-cache', metavar='DIR', default=None,
+                 help='Keep config API entities in DIR between runs, '
+                      'hosts are always revalidated')
+@Option.requires('--config-ttl', metavar='SECONDS', type=float, default=600,
+                 help='Use cached config API entities for SECONDS, '
+                      'revalidate older ones')
 class WithConfigURL(stage.Stage):
     def parse(self, args):
         super(WithConfigURL, self).parse(args)
         self.config_url = args.c
+        if args.config_cache:
+            cfg.use_cache(args.config_cache, args.config_ttl)
 
 
 @Option.requires('-p', help='AMT credentials', metavar='FILE',
@@ -174,6 +265,9 @@ class WithAMTCredentials(stage.Stage):
 @Option.requires('-lw', help='ssh login for Windows',
                  metavar='LOGIN', default='Administrator')
 class WithSSHCredentials(stage.Stage):
+    # Exit status of ssh itself failing, e.g. to connect.
+    SSH_FAILED = 255
+
     def get_login(self):
         return self.ssh_login_linux
 
@@ -192,13 +286,28 @@ class WithSSHCredentials(stage.Stage):
         return proc.run_remote_process(
             host.name, login, args, host.state.log, opts)
 
+    async def run_ssh_async(self, host, args, login, opts=None):
+        return await proc.run_remote_process_async(
+            host.name, login, args, host.state.log, opts)
+
     def run_ssh_checked(self, host, args, login, description, opts=None):
         rv, output = self.run_ssh(host, args, login, opts=opts)
+        if rv == self.SSH_FAILED:
+            raise stage.TransientError(f'failed to {description}, ssh failed')
         if rv:
             raise RuntimeError(f'failed to {description}')
         return output
 
 
+@Option.requires('-sc', help='Concurrent SSH connections allowed while '
+                 'waiting for hosts', metavar='CONNECTIONS', type=int,
+                 default=64)
+class WithSSHParallelism(stage.Stage):
+    def parse(self, args):
+        super(WithSSHParallelism, self).parse(args)
+        self.ssh_connections = args.sc
+
+
 @Option.requires('-l', help='Local address', metavar='ADDR')
 class WithLocalAddress(stage.Stage):
     def parse(self, args):
@@ -247,7 +356,7 @@ class WithNDDArgs(stage.Stage):
 
     def parse(self, args):
         super(WithNDDArgs, self).parse(args)
-        self.ndds = map(WithNDDArgs.NDDSpec, args.n)
+        self.ndds = list(map(WithNDDArgs.NDDSpec, args.n))
         self.ndd_port = args.np
 
 
@@ -0,0 +1,163 @@
+import concurrent.futures
+import contextlib
+import threading
+import time
+
+from . import log
+
+
+BACKENDS = ('process', 'thread')
+
+
+def add_params(parser):
+    parser.add_argument(
+        '--executor', choices=BACKENDS, default='process',
+        help='Run parallel stages in worker processes or threads')
+    parser.add_argument(
+        '-w', '--workers', metavar='NUM', type=int, default=0,
+        help='Maximum number of workers shared by all the parallel stages, '
+             'number of hosts by default')
+    parser.add_argument(
+        '--threads', metavar='NUM', type=int, default=8,
+        help='Number of threads to run simple stages for several hosts '
+             'at once')
+
+
+class Executor(object):
+    def __init__(self, backend, max_workers, threads=1):
+        assert backend in BACKENDS
+        self.backend = backend
+        self.max_workers = max_workers
+        self.threads = threads
+        self.pool = None
+        self.log_listener = None
+        self.reserved = 0
+        # Stages running concurrently share the pool.
+        self.lock = threading.Lock()
+
+    def reserve(self, workers):
+        '''Makes the pool started later have at least workers, the first
+        stages could run for fewer hosts than the next ones.'''
+        with self.lock:
+            self.reserved = max(self.reserved, workers)
+
+    def get_pool(self, workers):
+        with self.lock:
+            if self.pool is None:
+                self.pool = self.make_pool(
+                    self.max_workers if self.max_workers
+                    else max(workers, self.reserved))
+            return self.pool
+
+    def make_pool(self, max_workers):
+        if self.backend == 'process':
+            import multiprocessing  # Not needed until there are workers.
+            context = multiprocessing.get_context('fork')
+            # Every pool gets its own queue, so that workers killed
+            # by reset could not leave it locked for the next ones.
+            log_queue = context.Queue()
+            self.log_listener = log.listen(log_queue)
+            return concurrent.futures.ProcessPoolExecutor(
+                max_workers, mp_context=context,
+                initializer=log.forward_to, initargs=(log_queue,))
+        return concurrent.futures.ThreadPoolExecutor(max_workers)
+
+    def imap(self, fn, items, limit=0, timeout=None, limiter=None):
+        '''Calls fn for each of items, keeping at most limit calls running.
+
+        If limiter is given, a call for an item starts only once
+        limiter.try_acquire(item) succeeds, and limiter.release(item)
+        follows the call. Yields (item, result) pairs in order of
+        completion.'''
+        items = list(items)
+        limit = limit if limit else len(items)
+        pool = self.get_pool(len(items))
+        pending = {}
+        try:
+            while items or pending:
+                delay = None
+                for item in list(items):
+                    if len(pending) >= limit:
+                        break
+                    if limiter is not None:
+                        wait = limiter.try_acquire(item)
+                        if wait:
+                            delay = wait if delay is None else min(delay, wait)
+                            continue
+                    items.remove(item)
+                    pending[pool.submit(fn, item)] = item
+                if not pending:
+                    time.sleep(delay)
+                    continue
+                wait_for = timeout
+                if delay is not None and (timeout is None or delay < timeout):
+                    wait_for = delay
+                done, _ = concurrent.futures.wait(
+                    pending, wait_for,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                if not done and delay is None:
+                    raise TimeoutError('no results from workers in time')
+                for future in done:
+                    item = pending.pop(future)
+                    if limiter is not None:
+                        limiter.release(item)
+                    yield item, future.result()
+        finally:
+            # Slots of the calls not waited for, e.g. as the caller failed
+            # or was interrupted, would never be released otherwise.
+            for future, item in pending.items():
+                future.cancel()
+                if limiter is not None:
+                    limiter.release(item)
+
+    def fan_out(self, fn, items):
+        '''Calls fn for each of items in up to self.threads threads.'''
+        if self.threads <= 1:
+            for item in items:
+                fn(item)
+            return
+
+        pool = concurrent.futures.ThreadPoolExecutor(self.threads)
+        try:
+            for _ in pool.map(fn, items):
+                pass
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        else:
+            pool.shutdown()
+
+    def reset(self):
+        '''Kills all the workers, new ones will be started on demand.'''
+        with self.lock:
+            pool, self.pool = self.pool, None
+            # The listener is abandoned, stopping it could wait forever for
+            # a queue some killed worker has locked.
+            self.log_listener = None
+        if pool is None:
+            return
+        if self.backend == 'process':
+            for process in list(pool._processes.values()):
+                process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+            log_listener, self.log_listener = self.log_listener, None
+        if pool is not None:
+            pool.shutdown()
+        if log_listener is not None:
+            log_listener.stop()
+
+
+@contextlib.contextmanager
+def running(args):
+    executor = Executor(args.executor, args.workers, args.threads)
+    try:
+        yield executor
+    except BaseException:
+        executor.reset()
+        raise
+    finally:
+        executor.shutdown()
@@ -7,6 +7,8 @@ class Host(object):
         self.amt_host = None
         self.disk = None
         self.failure = None
+        # (stage, attempt, error) of every retry of a stage for the host.
+        self.retries = []
         self.state.active_hosts.add(self)
 
     def __str__(self):
@@ -16,9 +18,13 @@ class Host(object):
         return self.name.__lt__(other.name)
 
     def fail(self, stage, reason):
-        self.state.log.error(
-            f'host {self} failed, stage: {stage}, reason: {reason}'
-        )
-        self.failure = (stage, reason)
-        self.state.active_hosts.remove(self)
-        self.state.failed_hosts.add(self)
+        with self.state.lock:
+            if self not in self.state.active_hosts:
+                # Already failed concurrently, e.g. on interruption.
+                return
+            self.state.log.error(
+                f'host {self} failed, stage: {stage}, reason: {reason}'
+            )
+            self.failure = (stage, reason)
+            self.state.active_hosts.remove(self)
+            self.state.failed_hosts.add(self)
@@ -0,0 +1,111 @@
+import collections
+import contextlib
+import json
+import os
+import stat
+import threading
+
+from util import output
+
+
+DONE = 'done'
+FAILED = 'failed'
+ROLLED_BACK = 'rolled back'
+
+
+def add_params(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        '--journal', metavar='FILE',
+        help='Record stages finished by each host into FILE')
+    group.add_argument(
+        '--resume', metavar='JOURNAL',
+        help='Resume deployment recorded in JOURNAL, skipping stages '
+             'already finished by the hosts')
+
+
+class Journal(object):
+    def __init__(self, file_name, method, resume=False):
+        self.file_name = file_name
+        self.finished = collections.defaultdict(set)
+        self.failures = {}
+        self.lock = threading.Lock()
+        if resume:
+            cut = self.load(method)
+            self.output = output.opened(file_name, 'a')
+            if cut:
+                self.output.write('\n')
+        else:
+            self.output = output.opened(file_name, 'w')
+        # Journals piped to a coordinator can not be synced.
+        self.durable = stat.S_ISREG(os.fstat(self.output.fileno()).st_mode)
+        self.write({'method': method.name, 'stages': method.indices})
+
+    def load(self, method):
+        '''Loads the records, returns whether the last one was cut.'''
+        line = ''
+        with open(self.file_name) as input_:
+            for line in input_:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last record might be cut by a crash.
+                    continue
+                if 'method' in record:
+                    if record['method'] != method.name:
+                        raise RuntimeError(
+                            '{} is a journal of "{}" method'.format(
+                                self.file_name, record['method']))
+                    # Stages are recorded by index, which other -s would
+                    # make point to other stages.
+                    if record['stages'] != method.indices:
+                        raise RuntimeError(
+                            '{} is a journal of stages {}'.format(
+                                self.file_name, record['stages']))
+                    continue
+                host, index = record['host'], record['stage']
+                if record['event'] == DONE:
+                    self.finished[host].add(index)
+                elif record['event'] == FAILED:
+                    self.failures[host] = (index, record['reason'], False)
+                elif record['event'] == ROLLED_BACK:
+                    index, reason, _ = self.failures[host]
+                    self.failures[host] = (index, reason, True)
+                    self.finished[host].clear()
+        return not line.endswith('\n')
+
+    def write(self, record):
+        with self.lock:
+            self.output.write(json.dumps(record) + '\n')
+            self.output.flush()
+            if self.durable:
+                os.fsync(self.output.fileno())
+
+    def record(self, host, index, event, reason=None):
+        record = {'host': host.name, 'stage': index, 'event': event}
+        if reason is not None:
+            record['reason'] = str(reason)
+        self.write(record)
+
+    def has_finished(self, host, index):
+        return index in self.finished.get(host.name, ())
+
+    def failure(self, host):
+        return self.failures.get(host.name)
+
+    def close(self):
+        self.output.close()
+
+
+@contextlib.contextmanager
+def opened(args, method):
+    if args.resume is None and args.journal is None:
+        yield None
+        return
+
+    journal = Journal(args.resume or args.journal, method,
+                      resume=args.resume is not None)
+    try:
+        yield journal
+    finally:
+        journal.close()
@@ -0,0 +1,119 @@
+import asyncio
+import collections
+import contextlib
+import itertools
+import threading
+import time
+
+
+def add_params(parser):
+    parser.add_argument(
+        '--power-key', metavar='PROP', default='switch',
+        help='Host prop grouping hosts which share PXE, DHCP or power '
+             'circuit, e.g. switch, rack or circuit')
+    parser.add_argument(
+        '--power-limit', metavar='NUM', type=int, default=0,
+        help='Maximum number of concurrent reboots and resets of hosts with '
+             'the same --power-key, unlimited by default')
+    parser.add_argument(
+        '--power-hold', metavar='SECONDS', type=float, default=30,
+        help='Keep the slot of a reboot or reset taken for SECONDS after it, '
+             'while the host boots')
+    parser.add_argument(
+        '--power-rate', metavar='NUM', type=float, default=0,
+        help='Maximum number of reboots and resets started per second, '
+             'unlimited by default')
+
+
+class Limiter(object):
+    '''Limits concurrent power operations per key and the rate of starts.
+
+    Thread safe, shared by all the hosts and limited stages of a run.'''
+
+    POLL = 0.5
+
+    def __init__(self, prop, limit=0, hold=0, rate=0):
+        self.prop = prop
+        self.limit = limit
+        self.hold = hold
+        self.interval = 1.0 / rate if rate else 0
+        self.busy = collections.Counter()
+        self.held = []
+        self.next_start = 0
+        self.lock = threading.Lock()
+
+    def key(self, host):
+        # Hosts without the prop are not limited by other hosts.
+        value = host.props.get(self.prop)
+        return host.name if value is None else value
+
+    def interleave(self, hosts):
+        '''Orders hosts round-robin by key, so that workers taking them
+        in order do not all wait for the same key.'''
+        groups = collections.defaultdict(list)
+        for host in hosts:
+            groups[self.key(host)].append(host)
+        return [host
+                for batch in itertools.zip_longest(*groups.values())
+                for host in batch if host is not None]
+
+    def expire(self, now):
+        for until, key in list(self.held):
+            if until <= now:
+                self.held.remove((until, key))
+                self.busy[key] -= 1
+
+    def try_acquire(self, host):
+        '''Takes a slot for host, returns 0 or seconds to wait before
+        trying again.'''
+        key = self.key(host)
+        with self.lock:
+            now = time.monotonic()
+            self.expire(now)
+            if self.limit and self.busy[key] >= self.limit:
+                until = [u for u, k in self.held if k == key]
+                return min(until) - now if until else self.POLL
+            if now < self.next_start:
+                return self.next_start - now
+            self.busy[key] += 1
+            self.next_start = now + self.interval
+            return 0
+
+    def release(self, host):
+        with self.lock:
+            if self.hold and self.limit:
+                self.held.append(
+                    (time.monotonic() + self.hold, self.key(host)))
+            else:
+                self.busy[self.key(host)] -= 1
+
+    @contextlib.contextmanager
+    def slot(self, host):
+        while True:
+            delay = self.try_acquire(host)
+            if not delay:
+                break
+            time.sleep(delay)
+        try:
+            yield
+        finally:
+            self.release(host)
+
+    @contextlib.asynccontextmanager
+    async def async_slot(self, host):
+        # Polls instead of waiting on asyncio primitives, so that event
+        # loops of several threads could share the limiter.
+        while True:
+            delay = self.try_acquire(host)
+            if not delay:
+                break
+            await asyncio.sleep(delay)
+        try:
+            yield
+        finally:
+            self.release(host)
+
+
+def make(args):
+    return Limiter(args.power_key, args.power_limit, args.power_hold,
+                   args.power_rate)
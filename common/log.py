@@ -1,15 +1,23 @@
+import collections
 import contextlib
 import datetime
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import getpass
+import gzip
+import json
 import logging
+import logging.handlers
 import os
-import smtplib
+import queue
+import shutil
 import socket
+import subprocess
 import sys
 import tempfile
 import termcolor
+import zlib
+
+from . import report
+from util import output
 
 
 class CustomFormatter(logging.Formatter):
@@ -35,17 +43,140 @@ class CustomFormatter(logging.Formatter):
             return base
 
 
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({
+            'time': record.created,
+            'level': record.levelname,
+            'host': getattr(record, 'host', None),
+            'process': record.process,
+            'file': record.filename,
+            'line': record.lineno,
+            'message': record.getMessage(),
+        })
+
+
+class Relay(logging.Handler):
+    '''Passes records received from workers to the logger they came from.'''
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+class ByHost(logging.Handler):
+    '''Passes records to target grouped by host. Records of hosts are kept
+    until one of no host, e.g. of the method starting or finishing a stage,
+    comes, or capacity of them are kept. As any handler, it is flushed by
+    logging.shutdown at exit too.'''
+
+    def __init__(self, target, capacity=10000):
+        super(ByHost, self).__init__()
+        self.target = target
+        self.capacity = capacity
+        self.records = collections.defaultdict(list)
+        self.count = 0
+
+    def emit(self, record):
+        host = getattr(record, 'host', None)
+        if host is not None:
+            self.records[host].append(record)
+            self.count += 1
+            if self.count >= self.capacity:
+                self.flush()
+            return
+        self.flush()
+        self.target.handle(record)
+
+    def flush(self):
+        records, self.records = self.records, collections.defaultdict(list)
+        self.count = 0
+        for host in sorted(records):
+            for record in records[host]:
+                self.target.handle(record)
+        self.target.flush()
+
+    def close(self):
+        self.flush()
+        self.target.close()
+        super(ByHost, self).close()
+
+
+def forward_to(log_queue):
+    '''Makes a worker process send its log records to the parent, instead
+    of formatting and writing them itself.'''
+    loggers = [logging.getLogger()] + [
+        logger for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)]
+    for logger in loggers:
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+    logging.getLogger().addHandler(logging.handlers.QueueHandler(log_queue))
+
+
+def listen(log_queue):
+    listener = logging.handlers.QueueListener(log_queue, Relay())
+    listener.start()
+    return listener
+
+
 def add_params(parser):
     parser.add_argument(
         '-C', help='Colored log output', action='store_true')
+    parser.add_argument(
+        '--log-json', metavar='FILE',
+        help='Also write the log into FILE as JSON lines')
     parser.add_argument(
         '-r', metavar='ADDRESS', action='append',
         help='address(es) to send e-mail with report to')
+    parser.add_argument(
+        '--report-limit', metavar='BYTES', type=int, default=4 * 2 ** 20,
+        help='Cut the compressed log attached to the report at BYTES')
+    parser.add_argument(
+        '--log-archive', metavar='DIR',
+        help='Keep the full compressed log of every deployment in DIR')
 
 
-def send_report(args, state, log_file, start, finish):
-    msg = MIMEMultipart()
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHUNK = 2 ** 16
+
+
+def archive(log_input, path):
+    with gzip.open(path, 'wb') as output:
+        shutil.copyfileobj(log_input, output, CHUNK)
 
+
+def bound(size):
+    '''Returns the most bytes size bytes take gzipped, headers included
+    (as compressBound of zlib, plus the gzip header and trailer).'''
+    return size + (size >> 12) + (size >> 14) + (size >> 25) + 32
+
+
+def compress(log_input, output, limit):
+    '''Writes the log gzipped into output, cut so that it takes at most
+    limit bytes, and returns whether it was cut.'''
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    written = 0
+    # Input bytes compressor may still keep, without output for them yet.
+    kept = 0
+    for chunk in iter(lambda: log_input.read(CHUNK), b''):
+        if written + bound(kept + len(chunk)) > limit:
+            # Only flushed near the limit, as each flush costs some ratio.
+            written += output.write(compressor.flush(zlib.Z_SYNC_FLUSH))
+            kept = 0
+            if written + bound(len(chunk)) > limit:
+                room = limit - written - bound(0)
+                chunk = chunk[:max(0, room - (room >> 11) - 1)]
+                output.write(compressor.compress(chunk))
+                output.write(compressor.flush())
+                return True
+        written += output.write(compressor.compress(chunk))
+        kept += len(chunk)
+    output.write(compressor.flush())
+    return False
+
+
+def report_message(args, state, start, finish):
+    '''Returns the report of the deployment, but for the log.'''
     dest = ', '.join(sorted(state.groups) + sorted(state.hosts))
     subject = f'Deployment of "{dest}" with "{args.m}" method finished'
     text = 'Command line: {}.\n'.format(' '.join(sys.argv))
@@ -63,23 +194,56 @@ def send_report(args, state, log_file, start, finish):
             text += '{} failed, stage: {}, reason: {}\n'.format(
                 host.name, stage, reason)
 
+    retried = sorted(host for host in state.active_hosts |
+                     state.all_failed_hosts if host.retries)
+    if retried:
+        text += '\nRetries:\n'
+        for host in retried:
+            for stage, attempt, error in host.retries:
+                text += '{}: attempt {} of "{}" failed: {}\n'.format(
+                    host.name, attempt, stage, error)
+
+    if state.timings is not None:
+        text += '\n' + report.summary(state.timings.dump(state))
+
+    return {'subject': subject, 'text': text, 'to': args.r,
+            'limit': args.report_limit}
+
+
+def send_report(message, log_input, archived=None):
+    # Only imported when there is a report to send, to start up faster.
+    from email.mime.application import MIMEApplication
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+    import smtplib
+
+    msg = MIMEMultipart()
+
+    text = message['text']
+    with tempfile.TemporaryFile() as attachment:
+        cut = compress(log_input, attachment, message['limit'])
+        attachment.seek(0)
+        log_attach = MIMEApplication(attachment.read(), 'gzip')
     text += '\nSee the attached log for details.'
+    if cut:
+        text += ' The log is cut at {} bytes compressed.'.format(
+            message['limit'])
+    if archived:
+        text += '\nThe full log is kept in {}.'.format(archived)
 
     from_ = '{}@{}'.format(getpass.getuser(), socket.getfqdn())
 
-    msg['Subject'] = subject
+    msg['Subject'] = message['subject']
     msg['From'] = from_
-    msg['To'] = '; '.join(args.r)
+    msg['To'] = '; '.join(message['to'])
     msg.attach(MIMEText(text))
 
-    with open(log_file) as log_input:
-        log_attach = MIMEText(log_input.read())
-        log_attach.add_header('Content-Disposition', 'attachment',
-                              filename='log.txt')
-        msg.attach(log_attach)
+    log_attach.add_header('Content-Disposition', 'attachment',
+                          filename='log.txt.gz')
+    msg.attach(log_attach)
 
     sender = smtplib.SMTP('localhost')
-    sender.sendmail(from_, args.r, msg.as_string())
+    sender.sendmail(from_, message['to'], msg.as_string())
     sender.quit()
 
 
@@ -97,19 +261,72 @@ def temporary_log_file(method):
                               log_file)
 
 
+def perform(job, log_input):
+    try:
+        if job['archive']:
+            archive(log_input, job['archive'])
+            log_input.seek(0)
+        if job['report']:
+            send_report(job['report'], log_input, job['archive'])
+    except Exception:
+        logging.exception('Failed to deliver report')
+
+
+def deliver(args, state, log_file, start, finish):
+    '''Archives the log and sends the report from a process of its own, so
+    that locks around this one, like the flock of cron.sh, are not held by
+    a slow MTA.'''
+    job = {'archive': None, 'report': None}
+    if args.log_archive:
+        job['archive'] = os.path.abspath(os.path.join(
+            args.log_archive, 'dg_{}_{}_{}.log.gz'.format(
+                args.m, start.strftime('%Y%m%d-%H%M%S'), os.getpid())))
+    if args.r:
+        job['report'] = report_message(args, state, start, finish)
+    # Passed open, as the file is removed right after the process starts.
+    with open(log_file, 'rb') as log_input:
+        fd = log_input.fileno()
+        try:
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'common.log', str(fd)],
+                stdin=subprocess.PIPE, cwd=BASE, pass_fds=(fd,),
+                start_new_session=True)
+            with process.stdin:
+                process.stdin.write(json.dumps(job).encode())
+        except OSError:
+            logging.exception('Failed to start delivery, delivering in place')
+            perform(job, log_input)
+
+
 @contextlib.contextmanager
 def capturing(args, state):
     with contextlib.ExitStack() as stack:
         log_file = None
-        if args.r:
+        handlers = []
+        if args.r or args.log_archive:
             log_file = stack.enter_context(temporary_log_file(args.m))
-            handler = logging.FileHandler(log_file)
-        else:
-            handler = logging.StreamHandler()
+            file_handler = logging.FileHandler(log_file)
+            file_handler.setFormatter(CustomFormatter(args.C))
+            # The report is read host by host, the terminal as it goes.
+            handlers.append(ByHost(file_handler))
+        if not args.r:
+            handlers.append(logging.StreamHandler())
+            handlers[-1].setFormatter(CustomFormatter(args.C))
+        if args.log_json:
+            # Shared with the journal, when both go to stdout of a worker.
+            json_output = output.opened(args.log_json)
+            stack.callback(json_output.close)
+            handlers.append(logging.StreamHandler(json_output))
+            handlers[-1].setFormatter(JSONFormatter())
 
-        handler.setFormatter(CustomFormatter(args.C))
+        # Records of all the threads, and of worker processes relayed to
+        # this one, are formatted and written by a single listener.
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        listener = logging.handlers.QueueListener(log_queue, *handlers)
         state.log.setLevel(logging.INFO)
-        state.log.addHandler(handler)
+        state.log.addHandler(queue_handler)
+        listener.start()
 
         start = datetime.datetime.now()
         try:
@@ -117,10 +334,22 @@ def capturing(args, state):
         finally:
             finish = datetime.datetime.now()
 
-            state.log.removeHandler(handler)
-            handler.close()
+            state.log.removeHandler(queue_handler)
+            listener.stop()
+            for handler in handlers:
+                handler.close()
             if log_file:
-                try:
-                    send_report(args, state, log_file, start, finish)
-                except Exception:
-                    logging.exception('Failed to send report')
+                deliver(args, state, log_file, start, finish)
+
+
+def main(raw_args):
+    '''Delivers the log open as file descriptor raw_args[1] as the job
+    read from stdin says, see deliver.'''
+    job = json.load(sys.stdin)
+    with os.fdopen(int(raw_args[1]), 'rb') as log_input:
+        perform(job, log_input)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
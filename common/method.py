@@ -1,50 +1,478 @@
+import argparse
+import concurrent.futures
+import contextlib
+
+from . import journal
+from . import timing
 from util import hosts
 
 
+INTERRUPTED = 'interrupted'
+
+
+def wave_name(number):
+    return f'wave {number}' if number else 'canaries'
+
+
+def canaries(value):
+    if int(value) < 0:
+        raise argparse.ArgumentTypeError(f'{value} canaries requested')
+    return int(value)
+
+
+def growth(value):
+    if float(value) < 1:
+        raise argparse.ArgumentTypeError(f'{value} would shrink the waves')
+    return float(value)
+
+
 class Method(object):
     stages = []
+    # Stages depend on the previous one, unless listed here by index
+    # with indices of the stages they depend on. Stages independent of
+    # each other run at once, unless pipelined.
+    dependencies = {}
+    # Stage canaries and every next wave of hosts pass before the next
+    # wave starts, the last one by default.
+    canary_stage = None
+
+    @staticmethod
+    def add_params(parser):
+        parser.add_argument(
+            '-P', '--pipelined', action='store_true',
+            help='Let each host go through the stages on its own, only '
+                 'waiting for the others at barrier stages')
+        parser.add_argument(
+            '--canary', metavar='NUM', type=canaries, default=0,
+            help='Deploy NUM canary hosts up to --canary-stage first, then '
+                 'the other hosts in growing waves, as long as the waves '
+                 'pass. The hosts which passed go on together')
+        parser.add_argument(
+            '--canary-stage', metavar='NUM', type=int, default=None,
+            help='Stage each wave has to pass before the next one starts, '
+                 'chosen by the method by default')
+        parser.add_argument(
+            '--wave-growth', metavar='FACTOR', type=growth, default=2,
+            help='Make every next wave FACTOR times bigger')
+        parser.add_argument(
+            '--wave-failures', metavar='PERCENT', type=float, default=50,
+            help='Stop starting waves once more than PERCENT of the hosts '
+                 'of a wave failed')
 
     def __init__(self, stages):
-        self.stages = (
-            self.__class__.stages if stages is None
-            else [self.__class__.stages[index] for index in map(int, stages)]
+        self.indices = (
+            list(range(len(self.__class__.stages))) if stages is None
+            else list(map(int, stages))
         )
+        self.stages = [self.__class__.stages[index] for index in self.indices]
+        self.ancestors = self.__class__.get_ancestors()
+        self.pipelined = False
+        self.rollbacks = None
+        self.canary = 0
+        self.gate = len(self.stages) - 1
+        self.wave_growth = 2
+        self.wave_failures = 50
+
+    @classmethod
+    def get_dependencies(cls, index):
+        return cls.dependencies.get(index, (index - 1,) if index else ())
+
+    @classmethod
+    def get_ancestors(cls):
+        ancestors = []
+        for index in range(len(cls.stages)):
+            closure = set()
+            for dependency in cls.get_dependencies(index):
+                assert 0 <= dependency < index
+                closure |= {dependency} | ancestors[dependency]
+            ancestors.append(closure)
+        return ancestors
 
     def parse(self, args):
+        self.pipelined = args.pipelined
+        self.canary = args.canary
+        gate = self.canary_stage if args.canary_stage is None \
+            else args.canary_stage
+        if gate is not None:
+            # The last chosen stage up to the gate one.
+            self.gate = max([index for index, absolute
+                             in enumerate(self.indices) if absolute <= gate],
+                            default=0)
+        self.wave_growth = args.wave_growth
+        self.wave_failures = args.wave_failures
         for stage in self.stages:
             stage.parse(args)
 
-    def run(self, state):
-        for index, stage in enumerate(self.stages):
-            state.log.info('running stage "{}"'.format(stage))
+    def segments(self, start=0, stop=None):
+        '''Yields the stages from position start up to stop grouped into
+        segments, which run at once.'''
+        positions = range(start, len(self.stages) if stop is None else stop)
+        segment = []
+        if not self.pipelined:
+            for index in positions:
+                stage = self.stages[index]
+                if any(self.indices[other] in self.ancestors[
+                        self.indices[index]] for other, _ in segment):
+                    yield segment
+                    segment = []
+                segment.append((index, stage))
+            if segment:
+                yield segment
+            return
+
+        for index in positions:
+            stage = self.stages[index]
+            if not stage.barrier:
+                segment.append((index, stage))
+                continue
+            if segment:
+                yield segment
+                segment = []
+            yield [(index, stage)]
+        if segment:
+            yield segment
+
+    def record(self, state, host, index, event, reason=None):
+        if state.journal is not None:
+            state.journal.record(host, self.indices[index], event, reason)
+
+    def finished_before(self, state, host, index):
+        return (state.journal is not None and
+                self.stages[index].side_effects and
+                state.journal.has_finished(host, self.indices[index]))
+
+    def kept_for_resume(self, state, host):
+        # Interrupted hosts are not rolled back when there is a journal,
+        # so that the deployment could be resumed from where it stopped.
+        return state.journal is not None and host.failure[1] == INTERRUPTED
+
+    def resume_failures(self, state):
+        if state.journal is None:
+            return
+        for host in sorted(state.active_hosts):
+            failure = state.journal.failure(host)
+            if failure is None:
+                continue
+            index, reason, rolled_back = failure
+            host.fail(self.__class__.stages[index], reason)
+            state.failed_hosts.remove(host)
+            state.all_failed_hosts.add(host)
+            if not rolled_back:
+                state.log.warning(
+                    'doing rollback for {} failed before resume'.format(host))
+                self.rollback_later(
+                    state, [host],
+                    len([i for i in self.indices if i <= index]) - 1, index)
+
+    @contextlib.contextmanager
+    def rolling_back(self):
+        # Failed hosts are rolled back in background threads, so that
+        # the other hosts go on meanwhile. Stages of each rollback are
+        # still undone in reverse order.
+        self.rollbacks = concurrent.futures.ThreadPoolExecutor(
+            thread_name_prefix='rollback')
+        try:
+            yield
+        finally:
+            self.rollbacks.shutdown()
+            self.rollbacks = None
+
+    def rollback(self, state, hosts, index):
+        for stage in reversed(self.stages[:index + 1]):
+            try:
+                stage.rollback(state, hosts)
+            except Exception as e:
+                state.log.exception(e)
+                state.log.error('rollback of "{}" failed'.format(stage))
+
+    def rollback_later(self, state, hosts, index, failed):
+        '''Rolls hosts back from stage index in background, then records
+        that into journal for absolute stage index failed.'''
+        def rollback():
+            self.rollback(state, hosts, index)
+            if state.journal is not None:
+                for host in hosts:
+                    state.journal.record(host, failed, journal.ROLLED_BACK)
+        self.rollbacks.submit(rollback)
+
+    def rollback_host(self, host, index):
+        for stage in reversed(self.stages[:index + 1]):
             try:
+                stage.rollback_host(host)
+            except Exception as e:
+                host.state.log.exception(e)
+                host.state.log.error('rollback of "{}" failed'.format(stage))
+
+    def skipped(self, state, index, stage):
+        skipped = set(host for host in state.active_hosts
+                      if self.finished_before(state, host, index))
+        if skipped:
+            state.log.info('skipping "{}" for hosts finished it before: '
+                           '{}'.format(stage, hosts.format_hosts(skipped)))
+        return skipped
+
+    def run_stage(self, state, index, stage):
+        skipped = self.skipped(state, index, stage)
+        if skipped and skipped == state.active_hosts:
+            return
+
+        state.active_hosts -= skipped
+        ran = sorted(state.active_hosts)
+        state.log.info('running stage "{}"'.format(stage))
+        try:
+            with timing.measuring() as measurement:
                 stage.run(state)
+            state.log.info('finished "{}"'.format(stage))
+        except KeyboardInterrupt as e:
+            state.log.exception(e)
+            state.log.error('stage "{}" was interrupted'.format(stage))
+            for host in sorted(state.active_hosts):
+                host.fail(stage, INTERRUPTED)
+        except Exception as e:
+            state.log.exception(e)
+            state.log.error('stage "{}" failed completely'.format(stage))
+            for host in sorted(state.active_hosts):
+                host.fail(stage, 'stage completely failed')
+        finally:
+            state.active_hosts |= skipped
+            state.timings.finished(stage, measurement)
+        state.log.info('active hosts after this stage: {}'.format(
+            hosts.format_hosts(state.active_hosts)))
+        self.conclude(state, [(index, stage)],
+                      [(index, stage, ran, measurement)])
+
+    def run_view(self, view, index, stage):
+        state = view.state
+        ran = sorted(view.active_hosts)
+        state.log.info('running stage "{}"'.format(stage))
+        with timing.measuring() as measurement:
+            try:
+                stage.run(view)
                 state.log.info('finished "{}"'.format(stage))
-                state.log.info('active hosts after this stage: {}'.format(
-                    hosts.format_hosts(state.active_hosts)))
-            except (KeyboardInterrupt, Exception) as e:
+            except Exception as e:
                 state.log.exception(e)
                 state.log.error('stage "{}" failed completely'.format(stage))
-                for host in sorted(state.active_hosts):
+                for host in sorted(view.active_hosts):
                     host.fail(stage, 'stage completely failed')
+        state.timings.finished(stage, measurement)
+        return index, stage, ran, measurement
+
+    def run_concurrently(self, state, segment):
+        state.log.info('running stages {} concurrently'.format(
+            ', '.join('"{}"'.format(stage) for _, stage in segment)))
+        views = []
+        for index, stage in segment:
+            skipped = self.skipped(state, index, stage)
+            if not skipped or skipped != state.active_hosts:
+                views.append((state.view(state.active_hosts - skipped),
+                              index, stage))
+        results = []
+        executor = concurrent.futures.ThreadPoolExecutor(len(segment))
+        try:
+            futures = [executor.submit(self.run_view, *view)
+                       for view in views]
+            for future in futures:
+                results.append(future.result())
+        except KeyboardInterrupt as e:
+            state.log.exception(e)
+            state.log.error('concurrent stages were interrupted')
+            for host in sorted(state.active_hosts):
+                host.fail(segment[0][1], INTERRUPTED)
+            state.executor.reset()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        state.log.info('active hosts after these stages: {}'.format(
+            hosts.format_hosts(state.active_hosts)))
+        self.conclude(state, segment, results)
+
+    def conclude(self, state, segment, results):
+        '''Records what the stages run at once did, starts rollback of the
+        hosts failed in any of them from the last one.'''
+        for index, stage, ran, measurement in results:
+            for host in ran:
+                state.timings.add(stage, host, measurement)
+                if host in state.active_hosts:
+                    self.record(state, host, index, journal.DONE)
+        indices = dict((id(stage), index) for index, stage in segment)
+        last = segment[-1][0]
+
+        for host in sorted(state.failed_hosts):
+            if self.kept_for_resume(state, host):
+                state.failed_hosts.remove(host)
+                state.all_failed_hosts.add(host)
+            else:
+                index = indices.get(id(host.failure[0]), last)
+                self.record(state, host, index, journal.FAILED,
+                            host.failure[1])
+
+        if len(state.failed_hosts) > 0:
+            state.log.warning('failed hosts after "{}": {}'.format(
+                '", "'.join(str(stage) for _, stage in segment),
+                hosts.format_hosts(state.failed_hosts)))
+            state.log.warning('doing rollback for those')
+            self.rollback_later(state, sorted(state.failed_hosts), last,
+                                self.indices[last])
+
+    def run_host(self, host, segment, progress, running):
+        state = host.state
+        with state.current_host(host):
+            for index, stage in segment:
+                with state.lock:
+                    if host not in state.active_hosts:
+                        return
+                    progress[host] = index
+                    if self.finished_before(state, host, index):
+                        state.log.info(
+                            'skipping "{}" finished before'.format(stage))
+                        continue
+                    running.add(host)
+                state.log.info('running stage "{}"'.format(stage))
+                try:
+                    with timing.measuring() as measurement:
+                        stage.run_host(host)
+                except Exception as e:
+                    state.log.exception(e)
+                    host.fail(stage, 'stage completely failed')
+
+                state.timings.add(stage, host, measurement)
+                with state.lock:
+                    running.remove(host)
+                if host.failure is not None:
+                    if not self.kept_for_resume(state, host):
+                        self.record(state, host, index, journal.FAILED,
+                                    host.failure[1])
+                        state.log.warning('doing rollback')
+                        self.rollback_host(host, index)
+                        self.record(state, host, index, journal.ROLLED_BACK)
+                    return
+                state.log.info('finished "{}"'.format(stage))
+                self.record(state, host, index, journal.DONE)
+
+    def run_pipelined(self, state, segment):
+        state.log.info('running stages {} pipelined'.format(
+            ', '.join('"{}"'.format(stage) for _, stage in segment)))
+        first = segment[0][0]
+        progress, running = {}, set()
+        executor = concurrent.futures.ThreadPoolExecutor(
+            len(state.active_hosts))
+        try:
+            concurrent.futures.wait([
+                executor.submit(self.run_host, host, segment, progress,
+                                running)
+                for host in sorted(state.active_hosts)
+            ])
+        except KeyboardInterrupt as e:
+            state.log.exception(e)
+            state.log.error('pipelined stages were interrupted')
+            with state.lock:
+                interrupted = sorted(state.active_hosts)
+                for host in interrupted:
+                    host.fail(self.stages[progress.get(host, first)],
+                              INTERRUPTED)
+                # Hosts in the middle of some stage are handled
+                # by their own threads as soon as the stage is over.
+                idle = [host for host in interrupted
+                        if host not in running and
+                        not self.kept_for_resume(state, host)]
+            for host in idle:
+                index = progress.get(host, first)
+                self.record(state, host, index, journal.FAILED, INTERRUPTED)
+                self.rollback_later(state, [host],
+                                    progress.get(host, first - 1),
+                                    self.indices[index])
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
-            if len(state.failed_hosts) > 0:
-                state.log.warning('failed hosts after "{}": {}'.format(
-                    stage, hosts.format_hosts(state.failed_hosts)))
-                state.log.warning('doing rollback for those')
-                for stage in reversed(self.stages[:index + 1]):
-                    try:
-                        stage.rollback(state)
-                    except Exception as e:
-                        state.log.exception(e)
-                        state.log.error(
-                            'rollback of "{}" failed'.format(stage))
-                state.all_failed_hosts.update(state.failed_hosts)
-                state.failed_hosts.clear()
+        state.log.info('active hosts after these stages: {}'.format(
+            hosts.format_hosts(state.active_hosts)))
+        if len(state.failed_hosts) > 0:
+            state.log.warning('failed hosts after these stages: {}'.format(
+                hosts.format_hosts(state.failed_hosts)))
+
+    def run_segments(self, state, segments):
+        for segment in segments:
+            self.resume_failures(state)
+            if len(segment) == 1:
+                self.run_stage(state, *segment[0])
+            elif self.pipelined:
+                self.run_pipelined(state, segment)
+            else:
+                self.run_concurrently(state, segment)
+
+            state.all_failed_hosts.update(state.failed_hosts)
+            state.failed_hosts.clear()
 
             if not state.active_hosts:
                 state.log.error('all the hosts failed, stopping now')
                 return False
+        return True
+
+    def waves(self, hosts):
+        start, size = 0, self.canary
+        while start < len(hosts):
+            yield hosts[start:start + size]
+            start += size
+            size = max(int(size * self.wave_growth), size)
+
+    def run_waves(self, state):
+        '''Runs the stages up to the gate one wave of hosts after another,
+        starting with the canaries. Leaves the hosts passed active.'''
+        # Stages without side effects, e.g. getting the hosts, run at once.
+        first = next((index for index, stage in enumerate(self.stages)
+                      if stage.side_effects), self.gate + 1)
+        first = min(first, self.gate + 1)
+        if not self.run_segments(state, self.segments(0, first)):
+            return False
+
+        # Waves are spread over switches and the like.
+        pending = state.limiter.interleave(sorted(state.active_hosts))
+        # The stages after the waves need workers for all the hosts.
+        state.executor.reserve(len(pending))
+        passed = set()
+        start = 0
+        for number, wave in enumerate(self.waves(pending)):
+            start += len(wave)
+            state.active_hosts = set(wave)
+            state.log.info('running {}: {}'.format(
+                wave_name(number), hosts.format_hosts(wave)))
+            self.run_segments(state, self.segments(first, self.gate + 1))
+            passed |= state.active_hosts
+            failed = len(wave) - len(state.active_hosts)
+            if failed * 100 > self.wave_failures * len(wave):
+                self.stop_waves(state, pending[start:], number)
+                break
+
+        state.active_hosts = passed
+        if not passed:
+            state.log.error('all the hosts failed, stopping now')
+            return False
+        return True
+
+    def stop_waves(self, state, rest, number):
+        if not rest:
+            return
+        state.log.error(
+            'too many hosts failed in {}, not deploying the others'.format(
+                wave_name(number)))
+        # The hosts did not run any stage with side effects, so they are
+        # neither rolled back nor recorded into journal.
+        state.active_hosts = set(rest)
+        for host in rest:
+            host.fail(self.stages[self.gate],
+                      'not deployed after failures in {}'.format(
+                          wave_name(number)))
+        state.all_failed_hosts.update(state.failed_hosts)
+        state.failed_hosts.clear()
+
+    def run(self, state):
+        with self.rolling_back():
+            start = 0
+            if self.canary:
+                if not self.run_waves(state):
+                    return False
+                start = self.gate + 1
+            if not self.run_segments(state, self.segments(start)):
+                return False
 
         if len(state.all_failed_hosts) > 0:
             state.log.warning('finished. Failed hosts are: ')
@@ -0,0 +1,168 @@
+import argparse
+import collections
+import json
+import sys
+
+
+# Host is slow in a stage if it took that much longer than the median,
+# but at least MIN_SLOWDOWN seconds longer.
+SLOW_FACTOR = 1.5
+MIN_SLOWDOWN = 1.0
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def stage_key(record):
+    return (record['index'], record['stage'])
+
+
+def by_stage(data):
+    records = collections.defaultdict(list)
+    for record in data['records']:
+        records[stage_key(record)].append(record)
+    return records
+
+
+def critical_path(data):
+    '''Returns the records which finished last for each of the stages.'''
+    path = []
+    for _, records in sorted(by_stage(data).items()):
+        path.append(max(records, key=lambda r: r['start'] + r['wall']))
+    return path
+
+
+def stragglers(data):
+    '''Returns {host: [stages]} of stages the host was noticeably slow in.'''
+    slow = collections.defaultdict(list)
+    for key, records in sorted(by_stage(data).items()):
+        if len(records) < 2:
+            continue
+        median = percentile([r['wall'] for r in records], 50)
+        last = max(records, key=lambda r: r['start'] + r['wall'])
+        for record in records:
+            if record['wall'] - median < MIN_SLOWDOWN:
+                continue
+            if record['wall'] > median * SLOW_FACTOR or record is last:
+                slow[record['host']].append(key)
+    return slow
+
+
+def stage_stats(runs):
+    walls = collections.defaultdict(list)
+    descriptions = {}
+    for data in runs:
+        for key, records in by_stage(data).items():
+            walls[key].extend(r['wall'] for r in records)
+            descriptions[key] = records[0]['description']
+    return [
+        (key, descriptions[key], len(values),
+         percentile(values, 50), percentile(values, 95), max(values))
+        for key, values in sorted(walls.items())
+    ]
+
+
+def consistently_slow(runs):
+    '''Returns [(host, slow runs, runs)] for hosts which were stragglers
+    in at least half of the runs they took part in.'''
+    seen = collections.Counter()
+    slow = collections.Counter()
+    for data in runs:
+        seen.update(data['hosts'])
+        slow.update(stragglers(data).keys())
+    return sorted(
+        ((host, slow[host], seen[host]) for host in slow
+         if slow[host] * 2 >= seen[host]),
+        key=lambda item: (-item[1], item[0]))
+
+
+def format_seconds(seconds):
+    if seconds < 10:
+        return '{:.1f}s'.format(seconds)
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    return '{}m{:02d}s'.format(minutes, seconds) if minutes else \
+        '{}s'.format(seconds)
+
+
+def summary(data, top=5):
+    '''Returns short text summary of a single run for e-mail report.'''
+    path = critical_path(data)
+    if not path:
+        return 'No timings recorded.\n'
+
+    text = 'Slowest stages on critical path:\n'
+    for record in sorted(path, key=lambda r: -r['wall'])[:top]:
+        text += '  {:>7} {:3d}: {} ({})\n'.format(
+            format_seconds(record['wall']), record['index'],
+            record['description'], record['host'])
+
+    slow = stragglers(data)
+    if slow:
+        text += 'Slowest hosts:\n'
+        for host, stages in sorted(slow.items(),
+                                   key=lambda item: -len(item[1]))[:top]:
+            text += '  {}: slow in {} stage(s): {}\n'.format(
+                host, len(stages),
+                ', '.join(str(index) for index, _ in stages))
+    return text
+
+
+def report(runs, top):
+    text = ''
+    for data in runs:
+        total = data['finish'] - data['start']
+        text += 'Run of "{}" method, {} hosts, took {}\n'.format(
+            data['method'], len(data['hosts']), format_seconds(total))
+        text += 'Critical path:\n'
+        for record in critical_path(data):
+            text += '  {:3d} {:<40} {:>7} {}\n'.format(
+                record['index'], record['stage'],
+                format_seconds(record['wall']), record['host'])
+        text += '\n'
+
+    text += 'Stages:\n'
+    text += '  {:>3} {:<40} {:>6} {:>7} {:>7} {:>7}\n'.format(
+        '', 'stage', 'count', 'p50', 'p95', 'max')
+    for (index, stage), _, count, p50, p95, max_ in stage_stats(runs):
+        text += '  {:3d} {:<40} {:6d} {:>7} {:>7} {:>7}\n'.format(
+            index, stage, count, format_seconds(p50),
+            format_seconds(p95), format_seconds(max_))
+
+    slow = consistently_slow(runs)
+    if slow:
+        text += '\nConsistently slow hosts:\n'
+        for host, slow_runs, all_runs in slow[:top]:
+            text += '  {}: slow in {} of {} run(s)\n'.format(
+                host, slow_runs, all_runs)
+    return text
+
+
+def main(raw_args):
+    parser = argparse.ArgumentParser(
+        raw_args[0], description='Show critical path and stragglers '
+                                 'of finished deployments')
+    parser.add_argument(
+        '--top', metavar='NUM', type=int, default=10,
+        help='Number of slowest hosts to show')
+    parser.add_argument(
+        'timings', metavar='FILE', nargs='+',
+        help='Timings written with --timings')
+    args = parser.parse_args(raw_args[1:])
+
+    runs = []
+    for file_name in args.timings:
+        with open(file_name) as input_:
+            runs.append(json.load(input_))
+    sys.stdout.write(report(runs, args.top))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,354 @@
+import argparse
+import asyncio
+import collections
+import contextlib
+import errno
+import fcntl
+import functools
+import itertools
+import json
+import logging
+import os
+import shlex
+import socket
+import sys
+
+from clients import config as cfg
+from . import config
+
+
+SOCKET = '/run/dg/scheduler.sock'
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args(raw_args):
+    parser = argparse.ArgumentParser(
+        raw_args[0], description='Queue deployments, running the ones '
+                                 'which do not share hosts, images or locks '
+                                 'at once')
+    parser.add_argument(
+        '-S', '--socket', metavar='PATH', default=SOCKET,
+        help='Unix socket of the scheduler')
+    actions = parser.add_subparsers(dest='action', required=True)
+
+    serve = actions.add_parser('serve', help='Run the scheduler')
+    serve.add_argument(
+        '-j', '--jobs', metavar='NUM', type=int, default=4,
+        help='Maximum number of deployments running at once, 0 for no limit')
+    serve.add_argument(
+        '--poll', metavar='SECONDS', type=float, default=30,
+        help='Try to lock files of deployments waiting for other programs '
+             'every SECONDS')
+    serve.add_argument(
+        '--command', metavar='COMMAND', type=shlex.split, default=None,
+        help='Command running a deployment, main.py by default')
+
+    submit = actions.add_parser(
+        'submit', help='Queue a deployment. Arguments after -- are options '
+                       'of main.py or --config FILE')
+    submit.add_argument(
+        '-w', '--wait', action='store_true',
+        help='Wait for the deployment to finish and exit with its status')
+    submit.add_argument(
+        '--name', help='Name of the deployment, its options by default')
+    submit.add_argument('args', nargs=argparse.REMAINDER)
+
+    actions.add_parser('status', help='List queued and running deployments')
+
+    args = parser.parse_args(raw_args[1:])
+    if getattr(args, 'args', [])[:1] == ['--']:
+        args.args = args.args[1:]
+    return args
+
+
+def resolve_hosts(args):
+    '''Returns names of the hosts to deploy, or None if config service
+    is not available.'''
+    url = getattr(args, 'c', None)
+    if url is None:
+        return None
+    try:
+        names = set(cfg.get(url, sname)['name'] for sname in args.H)
+        for group in args.g:
+            names |= set(cfg.get(url, group)['hosts'])
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning('Failed to resolve hosts of %s: %s',
+                       ', '.join(args.H + args.g), e)
+        return None
+    return names
+
+
+def describe(raw_args, methods):
+    '''Returns resources the deployment with raw_args takes, mapped
+    to whether it takes them exclusively, and its --lock files.
+
+    Raises ValueError with the usage message for invalid options.'''
+    method_cls, stages = config.Option.choose_method_and_stages(
+        methods, raw_args, raising=True)
+    if stages == []:
+        raise ValueError('listing stages is not a deployment')
+    try:
+        method = method_cls(stages)
+    except IndexError:
+        raise ValueError(f'"{method_cls.name}" method has stages '
+                         f'0-{len(method_cls.stages) - 1} only')
+    parser = config.Option.get_method_parser(method, raw_args, raising=True)
+    args = parser.parse_args(raw_args)
+    if not args.H and not args.g:
+        parser.error('at least one host or group should be specified')
+
+    resources = {}
+
+    def take(name, exclusive):
+        resources[name] = resources.get(name, False) or exclusive
+
+    # Deployments with unknown hosts wait for all the others.
+    hosts = resolve_hosts(args)
+    take('hosts', hosts is None)
+    for name in hosts or ():
+        take(f'host {name}', True)
+
+    ndds = getattr(args, 'n', [])
+    for spec in map(config.WithNDDArgs.NDDSpec, ndds):
+        if spec.source is None:
+            take(f'file {os.path.realpath(spec.input_)}', False)
+    if ndds:
+        take(f'ndd port {args.np}', True)
+
+    for lock in args.lock or ():
+        take(f'file {os.path.realpath(lock.file_name)}',
+             lock.lock_mode == fcntl.LOCK_EX)
+
+    for stage in method.stages:
+        for name in stage.resources:
+            take(name, True)
+
+    return resources, args.lock or []
+
+
+class Job(object):
+    '''Deployment submitted to the scheduler.'''
+
+    ids = itertools.count(1)
+
+    def __init__(self, args, name, resources, locks):
+        self.id = next(Job.ids)
+        self.args = args
+        self.name = name or ' '.join(args)
+        self.resources = resources
+        self.locks = locks
+        self.lock_files = []
+        self.state = QUEUED
+        self.rv = None
+        self.finished = asyncio.Event()
+
+    def __str__(self):
+        return f'#{self.id} ({self.name})'
+
+    def conflicts(self, other):
+        return any(
+            name in other.resources
+            and (exclusive or other.resources[name])
+            for name, exclusive in self.resources.items())
+
+    def lock(self):
+        '''Locks files given with --lock like cron.sh did, so that other
+        programs, e.g. image builds, see them. Returns whether all of them
+        are locked.'''
+        for lock in sorted(self.locks):
+            lock_file = open(lock.file_name, 'a')
+            try:
+                fcntl.flock(lock_file, lock.lock_mode | fcntl.LOCK_NB)
+            except OSError as e:
+                lock_file.close()
+                self.unlock()
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    return False
+                raise
+            self.lock_files.append(lock_file)
+        return True
+
+    def unlock(self):
+        for lock_file in self.lock_files:
+            lock_file.close()
+        self.lock_files = []
+
+    def to_json(self):
+        return {'id': self.id, 'name': self.name, 'state': self.state,
+                'rv': self.rv}
+
+
+class Scheduler(object):
+    '''Runs deployments in order of submission, starting one as soon as it
+    does not conflict with the running and earlier queued ones.'''
+
+    def __init__(self, methods, command, jobs=4, poll=30):
+        self.methods = methods
+        self.command = command
+        self.limit = jobs
+        self.poll = poll
+        self.queue = []
+        self.running = []
+        self.history = collections.deque(maxlen=100)
+        self.changed = asyncio.Event()
+
+    async def submit(self, args, name=None):
+        for job in self.queue:
+            if job.args == args:
+                logger.info('%s is already queued', job)
+                return job
+        loop = asyncio.get_running_loop()
+        resources, locks = await loop.run_in_executor(
+            None, functools.partial(describe, args, self.methods))
+        job = Job(args, name, resources, locks)
+        self.queue.append(job)
+        logger.info('Queued %s', job)
+        self.changed.set()
+        return job
+
+    def start_ready(self):
+        waiting = list(self.running)
+        for job in list(self.queue):
+            if self.limit and len(self.running) >= self.limit:
+                break
+            if (not any(job.conflicts(other) for other in waiting)
+                    and job.lock()):
+                self.queue.remove(job)
+                self.running.append(job)
+                asyncio.ensure_future(self.run(job))
+            # Later jobs do not overtake waiting ones on their resources.
+            waiting.append(job)
+
+    async def run(self, job):
+        job.state = RUNNING
+        logger.info('Starting %s', job)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *self.command, *job.args)
+            job.rv = await process.wait()
+        except OSError as e:
+            logger.error('Failed to start %s: %s', job, e)
+            job.rv = -1
+        finally:
+            job.unlock()
+            job.state = FINISHED
+            self.running.remove(job)
+            self.history.append(job)
+            job.finished.set()
+            self.changed.set()
+        logger.info('Finished %s, rv is %s', job, job.rv)
+
+    async def dispatch(self):
+        while True:
+            self.changed.clear()
+            self.start_ready()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.changed.wait(), self.poll)
+
+    def status(self):
+        return [job.to_json()
+                for job in itertools.chain(self.history, self.running,
+                                           self.queue)]
+
+    async def handle(self, reader, writer):
+        def reply(message):
+            writer.write(json.dumps(message).encode() + b'\n')
+
+        try:
+            line = await reader.readline()
+            if not line:
+                return
+            request = json.loads(line)
+            if 'submit' in request:
+                try:
+                    job = await self.submit(
+                        request['submit'], request.get('name'))
+                except ValueError as e:
+                    reply({'error': str(e)})
+                else:
+                    reply(job.to_json())
+                    if request.get('wait'):
+                        await writer.drain()
+                        await job.finished.wait()
+                        reply(job.to_json())
+            else:
+                reply({'jobs': self.status()})
+            await writer.drain()
+        except (ValueError, ConnectionError) as e:
+            logger.warning('Bad request: %s', e)
+        finally:
+            writer.close()
+
+    async def serve(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self.handle, path)
+        logger.info('Listening on %s', path)
+        async with server:
+            await self.dispatch()
+
+
+def request(path, message):
+    '''Sends message to the scheduler, yields its replies.'''
+    with socket.socket(socket.AF_UNIX) as connection:
+        connection.connect(path)
+        connection.sendall(json.dumps(message).encode() + b'\n')
+        with connection.makefile() as replies:
+            for line in replies:
+                yield json.loads(line)
+
+
+def is_running(path):
+    with socket.socket(socket.AF_UNIX) as connection:
+        try:
+            connection.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def main(raw_args, methods, main_path):
+    args = parse_args(raw_args)
+    if args.action == 'serve':
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s %(levelname)-8s %(message)s')
+        if is_running(args.socket):
+            logger.error('Scheduler is already running on %s', args.socket)
+            return 2
+        command = args.command or [sys.executable, main_path]
+        scheduler = Scheduler(methods, command, args.jobs, args.poll)
+        with contextlib.suppress(KeyboardInterrupt):
+            asyncio.run(scheduler.serve(args.socket))
+        return 0
+
+    if args.action == 'submit':
+        deploy_args = config.get_args([raw_args[0]] + args.args)
+        message = {'submit': deploy_args, 'name': args.name,
+                   'wait': args.wait}
+    else:
+        message = {'status': True}
+
+    rv = 0
+    try:
+        for reply in request(args.socket, message):
+            if 'error' in reply:
+                print(reply['error'], file=sys.stderr)
+                return 2
+            if 'jobs' in reply:
+                for job in reply['jobs']:
+                    print('{id:5d} {state:<9} {rv!s:>4} {name}'.format(**job))
+            else:
+                print('{id:5d} {state:<9} {name}'.format(**reply))
+                if reply['state'] == FINISHED:
+                    rv = reply['rv']
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f'Scheduler is not running on {args.socket}', file=sys.stderr)
+        return 2
+    return rv
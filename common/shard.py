@@ -0,0 +1,215 @@
+import argparse
+import collections
+import concurrent.futures
+import json
+import logging
+import shlex
+import subprocess
+import threading
+
+from . import journal
+from util import hosts
+
+
+def add_params(parser):
+    parser.add_argument(
+        '--shard', metavar='ADDR=COMMAND', type=Shard.parse, action='append',
+        default=[],
+        help='Split the hosts across worker deploy servers, running main.py '
+             'on each with COMMAND, e.g. "10.0.0.2=ssh dg2 python3 '
+             'dg/main.py". ADDR replaces the local address on the worker')
+    parser.add_argument(
+        '--shard-by', metavar='PROP', default='switch',
+        help='Host prop grouping hosts, which are deployed by the same '
+             'worker, e.g. switch')
+
+
+class Shard(object):
+    '''Worker deploy server, running its share of the hosts.'''
+
+    STDERR_LINES = 20
+
+    def __init__(self, address, command):
+        self.address = address
+        self.command = command
+        self.hosts = []
+        self.stderr = collections.deque(maxlen=Shard.STDERR_LINES)
+
+    @staticmethod
+    def parse(spec):
+        if '=' not in spec:
+            raise argparse.ArgumentTypeError(
+                f'"{spec}" is not in ADDR=COMMAND format')
+        address, command = spec.split('=', 1)
+        return Shard(address, shlex.split(command))
+
+    def __str__(self):
+        return self.address
+
+    def args(self, raw_args, method_args):
+        '''Returns options of the deployment for this worker.'''
+        args = without_coordinator_args(raw_args)
+        for host in self.hosts:
+            args += ['-H', host.name]
+        # Results and log records come back as JSON lines on stdout.
+        args += ['--journal', '/dev/stdout', '--log-json', '/dev/stdout']
+        if hasattr(method_args, 'l'):
+            args += ['-l', self.address]
+        return args
+
+
+def without_coordinator_args(raw_args):
+    '''Drops options only the coordinator handles.'''
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    for name in ('-H', '-g', '-r', '--shard'):
+        parser.add_argument(name, action='append')
+    for name in ('--shard-by', '--journal', '--resume', '--log-json',
+                 '--log-archive', '--timings', '--timings-prom'):
+        parser.add_argument(name)
+    parser.add_argument('--lock', nargs='+')
+    parser.add_argument('-C', action='store_true')
+    return parser.parse_known_args(raw_args)[1]
+
+
+def split(state, shards, prop):
+    '''Spreads the active hosts across shards, keeping hosts with the same
+    prop together.'''
+    groups = collections.defaultdict(list)
+    for host in sorted(state.active_hosts):
+        groups[host.props.get(prop, host.name)].append(host)
+    for group in sorted(groups.values(), key=len, reverse=True):
+        min(shards, key=lambda shard: len(shard.hosts)).hosts.extend(group)
+    return [shard for shard in shards if shard.hosts]
+
+
+class Coordinator(object):
+    '''Runs a deployment on worker deploy servers, collecting per-host
+    results and log records of all the workers into a single state.'''
+
+    def __init__(self, state, method, raw_args, method_args):
+        self.state = state
+        self.method = method
+        self.raw_args = raw_args
+        self.method_args = method_args
+        self.lock = threading.Lock()
+        # Position of the first stage the workers run, and of the last
+        # one each host finished on its worker.
+        self.start = 0
+        self.finished = {}
+
+    def prepare(self):
+        '''Runs the leading stages without side effects, e.g. getting
+        the hosts, which the workers repeat for their share.'''
+        with self.method.rolling_back():
+            for index, stage in enumerate(self.method.stages):
+                if stage.side_effects:
+                    self.start = index
+                    break
+                self.method.run_stage(self.state, index, stage)
+        self.state.all_failed_hosts.update(self.state.failed_hosts)
+        self.state.failed_hosts.clear()
+
+    def relay(self, shard, record):
+        log_record = logging.makeLogRecord({
+            'name': self.state.logger.name,
+            'levelname': record['level'],
+            'levelno': logging.getLevelName(record['level']),
+            'msg': '{}: {}'.format(shard, record['message']),
+            'created': record['time'],
+            'filename': record['file'],
+            'lineno': record['line'],
+            'host': record['host'],
+        })
+        self.state.logger.handle(log_record)
+
+    def apply(self, shard, names, record):
+        if self.state.journal is not None:
+            self.state.journal.write(record)
+        host = names.get(record['host'])
+        if host is None:
+            return
+        if record['event'] == journal.DONE:
+            position = self.method.indices.index(record['stage'])
+            self.finished[host] = max(self.finished.get(host, 0), position)
+        elif record['event'] == journal.FAILED:
+            stage = self.method.__class__.stages[record['stage']]
+            host.fail(stage, '{} (on {})'.format(record['reason'], shard))
+
+    def run_shard(self, shard):
+        names = dict((host.name, host) for host in shard.hosts)
+        args = shard.args(self.raw_args, self.method_args)
+        self.state.log.info('starting worker {} for {}'.format(
+            shard, hosts.format_hosts(shard.hosts)))
+        try:
+            worker = subprocess.Popen(
+                shard.command + ['--config', '/dev/stdin'],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, text=True)
+        except OSError as e:
+            self.fail(shard, f'failed to start worker: {e}')
+            return
+        stderr = threading.Thread(
+            target=shard.stderr.extend, args=(worker.stderr,), daemon=True)
+        stderr.start()
+        worker.stdin.write(json.dumps(args))
+        worker.stdin.close()
+
+        for line in worker.stdout:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                self.state.log.warning('{}: {}'.format(shard, line.rstrip()))
+                continue
+            with self.lock:
+                if 'event' in record:
+                    self.apply(shard, names, record)
+                elif 'level' in record:
+                    self.relay(shard, record)
+        rv = worker.wait()
+        stderr.join()
+        if rv != 0 and self.fail(shard, f'worker exited with rv {rv}'):
+            for line in shard.stderr:
+                self.state.log.error('{}: {}'.format(shard, line.rstrip()))
+
+    def fail(self, shard, reason):
+        '''Fails the hosts of shard, which are still active, returns them.'''
+        with self.state.lock:
+            remaining = [host for host in shard.hosts
+                         if host in self.state.active_hosts]
+        for host in remaining:
+            # The hosts fail at the stage after the last one they finished.
+            position = self.start
+            if host in self.finished:
+                position = min(self.finished[host] + 1,
+                               len(self.method.stages) - 1)
+            host.fail(self.method.stages[position], reason)
+            self.method.record(self.state, host, position, journal.FAILED,
+                               reason)
+        return remaining
+
+    def run(self, shards):
+        self.prepare()
+        if not self.state.active_hosts:
+            self.state.log.error('all the hosts failed, stopping now')
+            return False
+
+        shards = split(self.state, shards, self.method_args.shard_by)
+        with concurrent.futures.ThreadPoolExecutor(len(shards)) as executor:
+            for future in [executor.submit(self.run_shard, shard)
+                           for shard in shards]:
+                future.result()
+
+        self.state.all_failed_hosts.update(self.state.failed_hosts)
+        self.state.failed_hosts.clear()
+        if not self.state.active_hosts:
+            self.state.log.error('all the hosts failed')
+            return False
+        if self.state.all_failed_hosts:
+            self.state.log.warning('finished. Failed hosts are: ')
+            for host in sorted(self.state.all_failed_hosts):
+                stage, reason = host.failure
+                self.state.log.warning('{}, stage: {}, reason: {}'.format(
+                    host.name, stage, reason))
+        else:
+            self.state.log.info('finished.')
+        return True
@@ -1,8 +1,74 @@
 import contextlib
-import multiprocessing
+import functools
+import threading
+import time
+
+from . import timing
+
+
+class TransientError(Exception):
+    '''Failure of a stage for a host, which may not happen again, e.g. a lost
+    connection.'''
+
+
+class Retry(object):
+    '''Policy of running a stage for a host again after errors, waiting
+    backoff times longer before every next attempt.'''
+
+    def __init__(self, errors=(TransientError,), attempts=3, delay=5,
+                 backoff=2, max_delay=60):
+        self.errors = errors
+        self.attempts = attempts
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+
+    def delays(self):
+        delay = self.delay
+        for _ in range(self.attempts - 1):
+            yield min(delay, self.max_delay)
+            delay *= self.backoff
+
+    def call(self, stage, host, fn, retries):
+        '''Returns fn(), retrying it while the retry budget of host lasts.
+        Appends (stage, attempt, error) of every retry to retries.'''
+        delays = self.delays()
+        attempt = 1
+        while True:
+            try:
+                return fn()
+            except self.errors as e:
+                delay = next(delays, None)
+                spent = len(host.retries) + len(retries)
+                if delay is None or spent >= host.state.retry_budget:
+                    raise
+                host.state.log.warning(
+                    'attempt {} of "{}" failed: {}, retrying in {} seconds'
+                    .format(attempt, stage, e, delay))
+                retries.append((str(stage), attempt, str(e)))
+            time.sleep(delay)
+            attempt += 1
 
 
 class Stage(object):
+    # Barrier stages run for all the active hosts at once, so every host
+    # has to reach them first. Other stages implement run_host and let
+    # each host go through them on its own in pipelined mode.
+    barrier = True
+    # Stages without side effects are run again for all the hosts
+    # when resuming a deployment from journal.
+    side_effects = True
+    # Limited stages reboot or reset hosts, so they take a slot of
+    # state.limiter for every host to avoid boot storms.
+    limited = False
+    # Local resources, which the stage can not share with other deployments,
+    # e.g. a server port. The scheduler does not run two deployments taking
+    # the same resource at once.
+    resources = ()
+    # Retry policy of SimpleStage and ParallelStage for each host,
+    # none by default.
+    retry = None
+
     def parse(self, args):
         pass
 
@@ -12,25 +78,65 @@ class Stage(object):
     def run(self, state):
         raise NotImplementedError
 
-    def rollback(self, state):
+    def run_host(self, host):
+        raise NotImplementedError
+
+    def rollback(self, state, hosts):
+        for host in hosts:
+            self.rollback_host(host)
+
+    def slot(self, host):
+        if not self.limited:
+            return contextlib.nullcontext()
+        return host.state.limiter.slot(host)
+
+    def async_slot(self, host):
+        if not self.limited:
+            return contextlib.nullcontext()
+        return host.state.limiter.async_slot(host)
+
+    def rollback_host(self, host):
         pass
 
+    def attempt(self, host, fn, retries):
+        if self.retry is None:
+            return fn()
+        return self.retry.call(self, host, fn, retries)
+
 
 class SimpleStage(Stage):
+    barrier = False
+
     def run(self, state):
-        for host in sorted(state.active_hosts):
+        hosts = sorted(state.active_hosts)
+        if self.limited:
+            hosts = state.limiter.interleave(hosts)
+        state.executor.fan_out(self.run_host, hosts)
+
+    def rollback(self, state, hosts):
+        state.executor.fan_out(self.rollback_host, hosts)
+
+    def run_host(self, host, fn=None):
+        '''Runs fn, or run_single, for host.'''
+        with host.state.current_host(host), \
+                host.state.timings.measure(self, host), self.slot(host):
+            retries = []
             try:
-                self.run_single(host)
+                self.attempt(host, functools.partial(fn or self.run_single,
+                                                     host), retries)
             except Exception as e:
                 host.fail(self, e)
+            finally:
+                host.retries.extend(retries)
 
-    def rollback(self, state):
-        for host in sorted(state.failed_hosts):
+    def rollback_host(self, host):
+        with host.state.current_host(host):
             try:
                 self.rollback_single(host)
             except Exception as e:
-                state.log.exception('rollback of {} for {} failed: {}'.format(
-                    self, host.name, e))
+                host.state.log.exception(
+                    'rollback of {} for {} failed: {}'.format(
+                        self, host.name, e))
 
     def run_single(self, host):
         raise NotImplementedError
@@ -39,47 +145,71 @@ class SimpleStage(Stage):
         pass
 
 
-def _run_forked(args):
-    stage, host = args
-    try:
-        with host.state.current_host(host):
-            stage.run_single(host)
-            return stage.failed, stage.failure_reason
-    except Exception as e:
-        host.state.log.exception('Parallel stage failed for {}'.format(host))
-        return True, 'exception occured: {}'.format(e)
+# Failures reported with ParallelStage.fail are kept per thread, so that
+# the same stage could run for several hosts at once in threads as well
+# as in forked processes.
+_failure = threading.local()
+
+
+def _run_single(stage, host):
+    _failure.failed, _failure.reason = False, None
+    stage.run_single(host)
+    return _failure.failed, _failure.reason
+
+
+def _run_forked(stage, host):
+    # Retries are passed back with the result, as host may be a copy.
+    retries = []
+    with timing.measuring() as measurement:
+        try:
+            with host.state.current_host(host):
+                failed, reason = stage.attempt(
+                    host, functools.partial(_run_single, stage, host),
+                    retries)
+        except Exception as e:
+            host.state.log.exception(
+                'Parallel stage failed for {}'.format(host))
+            failed, reason = True, 'exception occured: {}'.format(e)
+    return failed, reason, measurement, retries
 
 
 class ParallelStage(Stage):
     HUGE_TIMEOUT = 60 * 60 * 24
 
+    barrier = False
+
     def __init__(self, poolsize=0):
         self.poolsize = poolsize
-        self.failed = False
-        self.failure_reason = None
 
     def run(self, state):
         try:
-            pool = multiprocessing.Pool(
-                self.poolsize if self.poolsize else len(state.active_hosts))
-
             with self.prepared():
-                host_to_result = [
-                    (host, pool.apply_async(_run_forked, [(self, host)]))
-                    for host in sorted(state.active_hosts)
-                ]
-                for host, result in host_to_result:
-                    # Timeout is here to handle interruptions properly,
-                    # otherwise it will not work as expected due to bug.
-                    failed, reason = result.get(ParallelStage.HUGE_TIMEOUT)
+                results = state.executor.imap(
+                    functools.partial(_run_forked, self),
+                    sorted(state.active_hosts),
+                    limit=self.poolsize,
+                    # Timeout is here to handle interruptions properly.
+                    timeout=ParallelStage.HUGE_TIMEOUT,
+                    # Slots are taken here, as workers may be processes.
+                    limiter=state.limiter if self.limited else None)
+                for host, (failed, reason, measurement, retries) in results:
+                    state.timings.add(self, host, measurement)
+                    host.retries.extend(retries)
                     if failed:
                         assert reason
                         host.fail(self, reason)
         except BaseException:
-            pool.terminate()
+            state.executor.reset()
             raise
-        finally:
-            pool.close()
+
+    def run_host(self, host):
+        with self.prepared(), self.slot(host):
+            failed, reason, measurement, retries = _run_forked(self, host)
+        host.state.timings.add(self, host, measurement)
+        host.retries.extend(retries)
+        if failed:
+            assert reason
+            host.fail(self, reason)
 
     def run_single(self, host):
         return False, 'Not implemented.'
@@ -89,5 +219,5 @@ class ParallelStage(Stage):
         yield
 
     def fail(self, reason):
-        self.failed = True
-        self.failure_reason = reason
+        _failure.failed = True
+        _failure.reason = reason
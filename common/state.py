@@ -1,10 +1,17 @@
 import contextlib
+import contextvars
 import logging
+import threading
+
+
+_current_host = contextvars.ContextVar('current_host', default=None)
 
 
 class HostLoggerAdapter(logging.LoggerAdapter):
 
     def process(self, msg, kwargs):
+        kwargs['extra'] = dict(kwargs.get('extra') or {},
+                               host=str(self.extra['host']))
         return '[%s] %s' % (self.extra['host'], msg), kwargs
 
 
@@ -17,34 +24,80 @@ class State(object):
         parser.add_argument(
             '-g', metavar='GROUP', help='Group(s) to deploy',
             default=[], action='append')
+        parser.add_argument(
+            '--retry-budget', metavar='NUM', type=int, default=5,
+            help='Maximum number of retries of stages failed transiently '
+                 'for each host, 0 to fail hosts at once')
 
     def __init__(self, parser, args):
         self.hosts, self.groups = args.H, args.g
         if len(self.hosts) == 0 and len(self.groups) == 0:
             parser.error('at least one host or group should be specified')
 
+        self.retry_budget = args.retry_budget
+
         self.active_hosts = set()
         self.failed_hosts = set()
         self.all_failed_hosts = set()
 
-        self._current_host = None
+        self.executor = None
+        self.journal = None
+        self.timings = None
+        self.limiter = None
+        self.lock = threading.RLock()
         self.logger = logging.getLogger(__name__)
 
+    # Run-wide helpers, which are not passed to worker processes.
+    TRANSIENT = ('executor', 'journal', 'timings', 'limiter')
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for name in State.TRANSIENT + ('lock',):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name in State.TRANSIENT:
+            setattr(self, name, None)
+        self.lock = threading.RLock()
+
+    def view(self, hosts):
+        return StateView(self, hosts)
+
     @contextlib.contextmanager
     def current_host(self, host):
-        assert self._current_host is None
-        self._current_host = host
-        old_logger = self.logger
+        current = _current_host.get()
+        assert current is None or current is host
+        token = _current_host.set(host)
         try:
-            self.logger = HostLoggerAdapter(
-                old_logger,
-                {'host': self._current_host}
-            )
-            yield self._current_host
+            yield host
         finally:
-            self._current_host = None
-            self.logger = old_logger
+            _current_host.reset(token)
 
     @property
     def log(self):
-        return self.logger
+        host = _current_host.get()
+        if host is None:
+            return self.logger
+        return HostLoggerAdapter(self.logger, {'host': host})
+
+
+class StateView(object):
+    '''State with its own set of active hosts, for stages running at once.
+
+    Failures still go to the state the hosts belong to.'''
+
+    def __init__(self, state, hosts):
+        self.state = state
+        self.members = frozenset(hosts)
+
+    @property
+    def active_hosts(self):
+        '''Hosts of the view still active, so that failures in the stages
+        running alongside are seen too.'''
+        with self.state.lock:
+            return self.members & self.state.active_hosts
+
+    def __getattr__(self, name):
+        return getattr(self.state, name)
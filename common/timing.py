@@ -0,0 +1,209 @@
+import contextlib
+import dataclasses
+import json
+import os
+import tempfile
+import threading
+import time
+
+from util import proc
+
+
+def add_params(parser):
+    parser.add_argument(
+        '--timings', metavar='FILE',
+        help='Write wall time of every stage for every host into FILE '
+             'as JSON')
+    parser.add_argument(
+        '--timings-prom', metavar='FILE',
+        help='Write the timings into FILE for Prometheus textfile collector')
+
+
+@dataclasses.dataclass
+class Measurement:
+    start: float
+    wall: float = 0.0
+    subprocess: float = 0.0
+
+
+@contextlib.contextmanager
+def measuring():
+    measurement = Measurement(start=time.time())
+    with proc.accounted() as account:
+        try:
+            yield measurement
+        finally:
+            measurement.wall = time.time() - measurement.start
+            measurement.subprocess = account.seconds
+
+
+class Timings(object):
+    def __init__(self, method):
+        self.method = method
+        self.indices = dict(
+            (id(stage), index)
+            for stage, index in zip(method.stages, method.indices))
+        self.start = time.time()
+        self.finish = None
+        self.stages = {}
+        self.records = {}
+        self.lock = threading.Lock()
+
+    def finished(self, stage, measurement):
+        '''Records a run of stage, which runs once for each wave.'''
+        with self.lock:
+            self.stages.setdefault(id(stage), []).append(measurement)
+
+    def add(self, stage, host, measurement):
+        '''Records measurement unless there already is one for the host.'''
+        with self.lock:
+            self.records.setdefault((id(stage), host.name), measurement)
+
+    @contextlib.contextmanager
+    def measure(self, stage, host):
+        with measuring() as measurement:
+            yield measurement
+        self.add(stage, host, measurement)
+
+    def get_stage(self, stage):
+        return {
+            'index': self.indices[id(stage)],
+            'stage': stage.__class__.__name__,
+            'description': str(stage),
+        }
+
+    def dump(self, state):
+        stages = []
+        records = []
+        for stage in self.method.stages:
+            stage_records = sorted(
+                (host, record) for (stage_id, host), record
+                in self.records.items() if stage_id == id(stage))
+            runs = self.stages.get(id(stage), [])
+            # Stages run in pipelined mode have no common start.
+            measured = runs or [record for _, record in stage_records]
+            if not measured:
+                continue
+            start = min(record.start for record in measured)
+            finish = max(record.start + record.wall for record in measured)
+            whole = Measurement(start=start, wall=finish - start)
+
+            stages.append(dict(self.get_stage(stage),
+                               start=whole.start, wall=whole.wall))
+            for host, record in stage_records:
+                records.append(dict(
+                    self.get_stage(stage), host=host, start=record.start,
+                    wall=record.wall, subprocess=record.subprocess,
+                    queue=queue(runs, record)))
+
+        all_hosts = state.active_hosts | state.all_failed_hosts
+        return {
+            'method': self.method.name,
+            'start': self.start,
+            'finish': self.finish,
+            'hosts': sorted(host.name for host in all_hosts),
+            'failed': dict(
+                (host.name, str(host.failure[0]))
+                for host in sorted(state.all_failed_hosts)),
+            'stages': stages,
+            'records': records,
+        }
+
+
+def queue(runs, record):
+    '''Returns how long the host waited since the run of the stage it was
+    in had started.'''
+    starts = [run.start for run in runs if run.start <= record.start]
+    return record.start - max(starts) if starts else 0.0
+
+
+def write_atomically(file_name, text):
+    fd, temp_name = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(file_name)),
+        prefix='.{}.'.format(os.path.basename(file_name)))
+    try:
+        with os.fdopen(fd, 'w') as output:
+            output.write(text)
+        os.chmod(temp_name, 0o644)
+        os.replace(temp_name, file_name)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+
+
+def escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def labels(**kwargs):
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(key, escape(value))
+        for key, value in sorted(kwargs.items())))
+
+
+METRICS = [
+    ('dg_run_duration_seconds', 'Wall time of the whole deployment'),
+    ('dg_run_finish_timestamp_seconds', 'Time the deployment finished at'),
+    ('dg_run_hosts', 'Number of hosts deployed'),
+    ('dg_stage_duration_seconds', 'Wall time of deployment stage'),
+    ('dg_host_stage_duration_seconds', 'Wall time of stage for single host'),
+    ('dg_host_stage_queue_seconds',
+     'Time host waited for the stage after it had started'),
+    ('dg_host_stage_subprocess_seconds',
+     'Time spent in subprocesses while running stage for single host'),
+]
+
+
+def to_prometheus(data):
+    values = dict((name, []) for name, _ in METRICS)
+    method = data['method']
+    values['dg_run_duration_seconds'].append(
+        (labels(method=method), data['finish'] - data['start']))
+    values['dg_run_finish_timestamp_seconds'].append(
+        (labels(method=method), data['finish']))
+    failed = len(data['failed'])
+    values['dg_run_hosts'].extend([
+        (labels(method=method, result='ok'), len(data['hosts']) - failed),
+        (labels(method=method, result='failed'), failed),
+    ])
+    for stage in data['stages']:
+        values['dg_stage_duration_seconds'].append((
+            labels(method=method, index=stage['index'],
+                   stage=stage['stage']),
+            stage['wall']))
+    for record in data['records']:
+        host_labels = labels(method=method, index=record['index'],
+                             stage=record['stage'], host=record['host'])
+        values['dg_host_stage_duration_seconds'].append(
+            (host_labels, record['wall']))
+        values['dg_host_stage_queue_seconds'].append(
+            (host_labels, record['queue']))
+        values['dg_host_stage_subprocess_seconds'].append(
+            (host_labels, record['subprocess']))
+
+    lines = []
+    for name, help_ in METRICS:
+        lines.append('# HELP {} {}'.format(name, help_))
+        lines.append('# TYPE {} gauge'.format(name))
+        for labels_, value in values[name]:
+            lines.append('{}{} {:.6f}'.format(name, labels_, value))
+    return '\n'.join(lines) + '\n'
+
+
+@contextlib.contextmanager
+def exporting(args, state):
+    try:
+        yield
+    finally:
+        state.timings.finish = time.time()
+        if args.timings or args.timings_prom:
+            try:
+                data = state.timings.dump(state)
+                if args.timings:
+                    write_atomically(args.timings,
+                                     json.dumps(data, indent=2) + '\n')
+                if args.timings_prom:
+                    write_atomically(args.timings_prom, to_prometheus(data))
+            except Exception:
+                state.log.exception('Failed to write timings')
@@ -62,22 +62,33 @@ if [[ "$#" -ne 1 ]]; then usage "$0"; fi
 config=$1
 . "$config"
 
-cmdline=("$(choose_locker "${LOCK[@]}")" "$config" "${LOCK[@]}"
-         python3 "$BASE/main.py" -m "$METHOD" "${ARGS[@]}")
+args=(-m "$METHOD" "${ARGS[@]}")
 
-if ! [[ -z "$LOCAL_ADDRESS" ]]; then cmdline+=("-l" "$LOCAL_ADDRESS"); fi
-if ! [[ -z "$AMTPASSWD" ]]; then cmdline+=("-p" "$AMTPASSWD"); fi
+if ! [[ -z "$LOCAL_ADDRESS" ]]; then args+=("-l" "$LOCAL_ADDRESS"); fi
+if ! [[ -z "$AMTPASSWD" ]]; then args+=("-p" "$AMTPASSWD"); fi
 
-for group in "${DG_GROUPS[@]}"; do cmdline+=("-g" "$group"); done
-for host in "${DG_HOSTS[@]}"; do cmdline+=("-H" "$host"); done
+for group in "${DG_GROUPS[@]}"; do args+=("-g" "$group"); done
+for host in "${DG_HOSTS[@]}"; do args+=("-H" "$host"); done
 
-for image in "${NDD[@]}"; do cmdline+=("-n" "$image"); done
-if ! [[ -z "$NDD_PORT" ]]; then cmdline+=("-np" "$NDD_PORT"); fi
+for image in "${NDD[@]}"; do args+=("-n" "$image"); done
+if ! [[ -z "$NDD_PORT" ]]; then args+=("-np" "$NDD_PORT"); fi
 
-for host in "${BAN[@]}"; do cmdline+=("-b" "$host"); done
+for host in "${BAN[@]}"; do args+=("-b" "$host"); done
 
-if [[ "${#STAGES[@]}" > 0 ]]; then cmdline+=("-s" "${STAGES[@]}"); fi
+if [[ "${#STAGES[@]}" > 0 ]]; then args+=("-s" "${STAGES[@]}"); fi
 
-for address in "${REPORT[@]}"; do cmdline+=("-r" "$address"); done
+for address in "${REPORT[@]}"; do args+=("-r" "$address"); done
 
-"${cmdline[@]}"
+# The scheduler queues the deployment until its hosts and locks are free.
+SCHEDULER=${SCHEDULER:-/run/dg/scheduler.sock}
+if [[ -S "$SCHEDULER" ]]; then
+  if [[ "${#LOCK[@]}" > 0 ]]; then
+    args+=("--lock")
+    for lockfile in "${LOCK[@]}"; do args+=("$lockfile,r"); done
+  fi
+  exec python3 "$BASE/scheduler.py" -S "$SCHEDULER" \
+    submit --name "$config" -- "${args[@]}"
+fi
+
+"$(choose_locker "${LOCK[@]}")" "$config" "${LOCK[@]}" \
+  python3 "$BASE/main.py" "${args[@]}"
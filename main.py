@@ -1,13 +1,19 @@
 import sys
 
 from common import config
-from methods import amt, simple, single, stdm
+
+
+# Method modules are imported only once a method is chosen.
+METHODS = [
+    config.LazyMethod('amt', 'methods.amt', 'AMTMethod'),
+    config.LazyMethod('simple', 'methods.simple', 'SimpleMethod'),
+    config.LazyMethod('single', 'methods.single', 'SingleMethod'),
+    config.LazyMethod('stdm', 'methods.stdm', 'StdMMethod'),
+]
 
 
 def main(raw_args):
-    return config.execute_with(
-        raw_args, [amt.AMTMethod, simple.SimpleMethod, single.SingleMethod,
-                   stdm.StdMMethod])
+    return config.execute_with(raw_args, METHODS)
 
 
 if __name__ == '__main__':
@@ -28,3 +28,14 @@ class SimpleMethod(method.Method):
         ssh.MaybeRebootLocalLinux(*ssh.Timeouts.TINY),
         ssh.CheckIsAccessible(*ssh.Timeouts.NORMAL),
     ]
+
+    dependencies = {
+        # Once booted into COW memory, the boot is reset, COW config is
+        # stored and network is checked at once.
+        7: (5,),
+        8: (5,),
+        9: (6, 7, 8),
+    }
+
+    # Canaries have to boot into COW memory image before the other hosts.
+    canary_stage = 5
@@ -20,3 +20,14 @@ class SingleMethod(method.Method):
         ssh.RebootHost(*ssh.Timeouts.TINY),
         ssh.WaitUntilBootedIntoLocalLinux(*ssh.Timeouts.BIG),
     ]
+
+    dependencies = {
+        # Once booted into COW memory, the boot is reset, COW config is
+        # stored and network is checked at once.
+        7: (5,),
+        8: (5,),
+        9: (6, 7, 8),
+    }
+
+    # Canaries have to boot into COW memory image before the other hosts.
+    canary_stage = 5
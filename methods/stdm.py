@@ -36,3 +36,18 @@ class StdMMethod(method.Method):
         ssh.MaybeRebootLocalLinux(*ssh.Timeouts.TINY),
         ssh.CheckIsAccessible(*ssh.Timeouts.NORMAL),
     ]
+
+    dependencies = {
+        # Boot into COW memory is configured along with IDE-R redirection.
+        6: (4,),
+        7: (5, 6),
+        # Both are undone once the host has booted.
+        10: (8,),
+        11: (9, 10),
+        # Network is checked while COW config is stored.
+        14: (12,),
+        15: (13, 14),
+    }
+
+    # Canaries have to boot into COW memory image before the other hosts.
+    canary_stage = 8
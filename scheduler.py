@@ -0,0 +1,11 @@
+import os
+import sys
+
+from common import scheduler
+import main
+
+
+if __name__ == '__main__':
+    sys.exit(scheduler.main(
+        sys.argv, main.METHODS,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')))
@@ -1,4 +1,4 @@
 #!/usr/bin/env bash
 
-apt-get -y install libsoap-lite-perl mono-devel python3-pip python3-termcolor
+apt-get -y install mono-devel python3-pip python3-termcolor
 pip install -r "$(dirname "$0")/requirements.txt"
@@ -0,0 +1,67 @@
+import argparse
+import sys
+
+from . import backends
+from common import config
+
+
+def parse_args(raw_args):
+    parser = argparse.ArgumentParser(
+        raw_args[0], description='Run deployment against simulated hosts. '
+                                 'Arguments after -- are passed to main.py, '
+                                 'hosts are available as "sim" group, '
+                                 'deployed unless -H or -g is given')
+    parser.add_argument(
+        '--hosts', metavar='NUM', type=int, default=10,
+        help='Number of simulated hosts')
+    parser.add_argument(
+        '--latency', metavar='BACKEND=SECONDS[:STDDEV]', action='append',
+        type=backends.parse_latency, default=[],
+        help='Latency of backend calls, one of {}'.format(
+            ', '.join(backends.BACKENDS)))
+    parser.add_argument(
+        '--failures', metavar='BACKEND=PROBABILITY', action='append',
+        type=backends.parse_failures, default=[],
+        help='Probability of backend call failure')
+    parser.add_argument(
+        '--time-scale', metavar='FACTOR', type=float, default=0.01,
+        help='Scale timeouts of waiting stages by FACTOR')
+    parser.add_argument(
+        '--seed', type=int, default=None, help='Random seed')
+    parser.add_argument(
+        '--record', metavar='FILE',
+        help='Append every simulated call, but reads of the config API, '
+             'to FILE as JSON lines')
+    parser.add_argument('args', nargs=argparse.REMAINDER)
+    return parser.parse_args(raw_args[1:])
+
+
+def main(raw_args):
+    args = parse_args(raw_args)
+    profiles = dict((backend, backends.Profile())
+                    for backend in backends.BACKENDS)
+    for backend, latency, stddev in args.latency:
+        profiles[backend].latency = latency
+        profiles[backend].stddev = stddev
+    for backend, failures in args.failures:
+        profiles[backend].failures = failures
+
+    simulation = backends.Simulation(args.hosts, profiles, args.seed,
+                                     args.record)
+    simulation.install()
+
+    # Imported after the backends are replaced on purpose.
+    import main as main_
+    backends.scale_timeouts([method.load() for method in main_.METHODS],
+                            args.time_scale)
+
+    method_args = args.args[1:] if args.args[:1] == ['--'] else args.args
+    method_args = config.get_args(['main.py'] + method_args)
+    # Workers of a sharded deployment get their own hosts.
+    if '-H' not in method_args and '-g' not in method_args:
+        method_args = ['-g', backends.GROUP] + method_args
+    return main_.main(['main.py'] + method_args)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
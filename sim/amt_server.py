@@ -0,0 +1,167 @@
+import argparse
+import http.server
+import os
+import sys
+import threading
+import urllib.request
+import xml.etree.ElementTree as ElementTree
+
+from clients import amt
+
+
+def parse_args(raw_args):
+    parser = argparse.ArgumentParser(
+        raw_args[0], description='Run a stand-in AMT host answering '
+                                 'RemoteControlService calls with digest '
+                                 'authentication, e.g. to try clients.amt '
+                                 'with clients.amt.PORT set to --port')
+    parser.add_argument(
+        '--address', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument(
+        '--port', type=int, default=amt.PORT, help='Port to listen on')
+    parser.add_argument('--user', default='admin', help='AMT user')
+    parser.add_argument('--password', default='admin', help='AMT password')
+    parser.add_argument(
+        '--state', type=int, default=amt.S5,
+        help='Power state the host starts in, S5 (soft-off) by default')
+    parser.add_argument(
+        '--nonce-uses', metavar='NUM', type=int, default=0,
+        help='Make nonces stale after NUM requests, never by default')
+    return parser.parse_args(raw_args[1:])
+
+
+class Server(http.server.ThreadingHTTPServer):
+    '''Stand-in AMT host, keeping its power state and the calls made.'''
+
+    daemon_threads = True
+    REALM = 'Digest:STANDIN'
+
+    def __init__(self, address, user, password, state=amt.S5,
+                 nonce_uses=0):
+        super(Server, self).__init__(address, Handler)
+        self.user = user
+        self.password = password
+        self.power_state = state
+        self.nonce_uses = nonce_uses
+        self.nonces = {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def challenge(self, stale=False):
+        nonce = os.urandom(16).hex()
+        with self.lock:
+            self.nonces[nonce] = 0
+        return 'Digest realm="{}", nonce="{}", qop="auth"{}'.format(
+            Server.REALM, nonce, ', stale="true"' if stale else '')
+
+    def authorize(self, header, method):
+        '''Returns whether header authorizes the request, and whether its
+        nonce is stale.'''
+        if not header.startswith('Digest '):
+            return False, False
+        fields = urllib.request.parse_keqv_list(
+            urllib.request.parse_http_list(header.split(' ', 1)[1]))
+        nonce = fields.get('nonce')
+        with self.lock:
+            if nonce not in self.nonces:
+                return False, True
+            self.nonces[nonce] += 1
+            if self.nonce_uses and self.nonces[nonce] > self.nonce_uses:
+                del self.nonces[nonce]
+                return False, True
+        expected = amt.md5(
+            amt.md5(self.user, Server.REALM, self.password), nonce,
+            fields.get('nc', ''), fields.get('cnonce', ''), 'auth',
+            amt.md5(method, fields.get('uri', '')))
+        return (fields.get('username') == self.user
+                and fields.get('response') == expected), False
+
+    def call(self, method, params):
+        '''Returns status and named values of the response.'''
+        with self.lock:
+            self.calls.append((method, params))
+            if method == 'GetSystemPowerState':
+                return 0, [('SystemPowerState', self.power_state)]
+            if params.get('IanaOemNumber') != amt.IANA_OEM_NUMBER:
+                return 0x801, []
+            command = params.get('Command')
+            if command not in amt.COMMANDS.values():
+                return 0x803, []
+            special = params.get('SpecialCommand')
+            if special is not None and special not in (
+                    list(amt.SPECIAL_COMMANDS.values())
+                    + list(amt.OEM_SPECIAL_COMMANDS.values())):
+                return 0x804, []
+            self.power_state = (amt.S5 if command == amt.COMMANDS['powerdown']
+                                else amt.S0)
+            return 0, []
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def reply(self, code, body=b'', headers=()):
+        self.send_response(code)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != amt.SERVICE:
+            return self.reply(404)
+        authorized, stale = self.server.authorize(
+            self.headers.get('Authorization', ''), self.command)
+        if not authorized:
+            return self.reply(401, headers=[
+                ('WWW-Authenticate', self.server.challenge(stale))])
+
+        try:
+            request = ElementTree.fromstring(body).find(
+                '{{{}}}Body'.format(amt.SOAP_NAMESPACE))[0]
+            method = request.tag.split('}')[-1]
+            params = dict((child.tag.split('}')[-1], int(child.text))
+                          for child in request)
+        except (ElementTree.ParseError, TypeError, IndexError, ValueError):
+            return self.reply(400)
+        if method not in ('GetSystemPowerState', 'RemoteControl'):
+            return self.envelope(
+                500, '<soap:Fault><faultcode>soap:Client</faultcode>'
+                     '<faultstring>unknown method</faultstring></soap:Fault>')
+
+        status, values = self.server.call(method, params)
+        self.envelope(
+            200, '<{0}Response xmlns="{1}"><Status>{2}</Status>{3}'
+                 '</{0}Response>'.format(
+                     method, amt.NAMESPACE, status,
+                     ''.join('<{0}>{1}</{0}>'.format(name, value)
+                             for name, value in values)))
+
+    def envelope(self, code, content):
+        self.reply(code, (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<soap:Envelope xmlns:soap="{}"><soap:Body>{}'
+            '</soap:Body></soap:Envelope>'.format(
+                amt.SOAP_NAMESPACE, content)).encode(),
+            [('Content-Type', 'text/xml; charset=utf-8')])
+
+    def log_message(self, *args):
+        pass
+
+
+def main(raw_args):
+    args = parse_args(raw_args)
+    server = Server((args.address, args.port), args.user, args.password,
+                    args.state, args.nonce_uses)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
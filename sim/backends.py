@@ -0,0 +1,192 @@
+import asyncio
+import contextlib
+import copy
+import json
+import os
+import random
+import time
+import urllib.error
+
+from clients import amt as amt_client
+from clients import amtredird
+from clients import config as cfg
+from stages import amt, network, ssh
+from util import proc
+
+
+BACKENDS = ('ssh', 'config', 'amtredird', 'amt', 'ndd')
+
+GROUP = 'sim'
+DOMAIN = 'sim'
+
+
+class Profile(object):
+    '''Latency and failure distribution of a simulated backend.'''
+
+    def __init__(self, latency=0.0, stddev=0.0, failures=0.0):
+        self.latency = latency
+        self.stddev = stddev
+        self.failures = failures
+
+    def delay(self, rng):
+        return max(0.0, rng.gauss(self.latency, self.stddev))
+
+    def fails(self, rng):
+        return rng.random() < self.failures
+
+
+def parse_latency(spec):
+    backend, value = spec.split('=', 1)
+    mean, _, stddev = value.partition(':')
+    return backend, float(mean), float(stddev) if stddev else 0.0
+
+
+def parse_failures(spec):
+    backend, value = spec.split('=', 1)
+    return backend, float(value)
+
+
+def get_hostname(index):
+    return 'sim{:05d}'.format(index)
+
+
+class Simulation(object):
+    def __init__(self, hosts, profiles, seed=None, record=None):
+        self.hosts = [get_hostname(index) for index in range(hosts)]
+        self.profiles = profiles
+        self.rng = random.Random(seed)
+        # Power states of AMT hosts, which are soft-off until powered up.
+        self.power = {}
+        # Calls are appended a line at a time, so that forked workers
+        # could record theirs too.
+        self.record_fd = None
+        if record is not None:
+            self.record_fd = os.open(
+                record, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def record(self, backend, host, args):
+        if self.record_fd is not None:
+            os.write(self.record_fd, (json.dumps(
+                {'backend': backend, 'host': host, 'args': args}) +
+                '\n').encode())
+
+    def call(self, backend):
+        '''Sleeps for the latency of a call, returns whether it failed.'''
+        profile = self.profiles[backend]
+        time.sleep(profile.delay(self.rng))
+        return profile.fails(self.rng)
+
+    async def call_async(self, backend):
+        profile = self.profiles[backend]
+        await asyncio.sleep(profile.delay(self.rng))
+        return profile.fails(self.rng)
+
+    def entity(self, name):
+        short = name.split('.', 1)[0]
+        if short == GROUP:
+            return {'hosts': ['{}.{}'.format(host, DOMAIN)
+                              for host in self.hosts]}
+        if short.endswith('-amt'):
+            return {'name': '{}.{}'.format(short, DOMAIN)}
+        return {
+            'name': '{}.{}'.format(short, DOMAIN),
+            'sname': short,
+            'props': {
+                'amt': '{}-amt'.format(short),
+                'switch': 'switch{}'.format(int(short[3:]) // 48),
+                'services': [],
+            },
+        }
+
+    def config_get(self, base_url, entity):
+        if self.call('config'):
+            raise urllib.error.URLError('simulated config API failure')
+        return self.entity(entity)
+
+    def config_set(self, base_url, entity, props):
+        self.record('config', entity, props)
+        if self.call('config'):
+            raise urllib.error.URLError('simulated config API failure')
+
+    def amtredird_list(self, base_url):
+        self.call('amtredird')
+        return ['{}-amt.{}'.format(host, DOMAIN) for host in self.hosts]
+
+    def amtredird_change(self, base_url, clients):
+        self.record('amtredird', None, sorted(clients))
+        self.call('amtredird')
+        return dict((client, (1 if self.profiles['amtredird'].fails(self.rng)
+                              else 0, None))
+                    for client in clients)
+
+    def amt_power_state(self, host, credentials):
+        if self.call('amt'):
+            raise amt_client.AMTError(host, 0x1)
+        return self.power.get(host, amt_client.S5)
+
+    def amt_remote_control(self, host, credentials, command, special=None):
+        self.record('amt', host, [command, special])
+        if self.call('amt'):
+            raise amt_client.AMTError(host, 0x1)
+        self.power[host] = (amt_client.S5 if command == 'powerdown'
+                            else amt_client.S0)
+
+    @staticmethod
+    def ssh_output(args):
+        if args[:1] == ['iperf']:
+            return '0,0,0,0,0,0,0,0,{}\n'.format(10 ** 10)
+        if args[:1] == ['vgs']:
+            return json.dumps({'report': [{'vg': [{'vg_name': 'sim'}]}]})
+        return ''
+
+    def run_process(self, args, log, stdout=None, stderr=None):
+        log.info(f'simulating {args}')
+        backend = 'ndd' if args[0].endswith('ndd.py') else 'ssh'
+        self.record(backend, None, args)
+        return (1 if self.call(backend) else 0), ''
+
+    def run_remote_process(self, host, login, args, log, opts):
+        log.info(f'simulating ssh {host} {args}')
+        self.record('ssh', host, args)
+        if self.call('ssh'):
+            return 255, ''
+        return 0, self.ssh_output(args)
+
+    async def run_remote_process_async(self, host, login, args, log, opts):
+        log.info(f'simulating ssh {host} {args}')
+        self.record('ssh', host, args)
+        if await self.call_async('ssh'):
+            return 255, ''
+        return 0, self.ssh_output(args)
+
+    def install(self):
+        '''Replaces all the backends with the simulated ones.'''
+        cfg.get = self.config_get
+        cfg.set = self.config_set
+        # restart goes through the simulated stop and start.
+        amtredird.list = self.amtredird_list
+        amtredird.start = amtredird.stop = self.amtredird_change
+        amt_client.power_state = self.amt_power_state
+        amt_client.remote_control = self.amt_remote_control
+        proc.run_process = self.run_process
+        proc.run_remote_process = self.run_remote_process
+        proc.run_remote_process_async = self.run_remote_process_async
+        network.EnsureNetworkSpeed.prepared = (
+            lambda stage: contextlib.nullcontext())
+
+
+def scale_timeouts(methods, factor):
+    '''Makes waiting stages of the methods, and retries, wait factor times
+    less.'''
+    for method in methods:
+        for stage in method.stages:
+            if isinstance(stage, ssh.ExecuteRemoteCommands):
+                stage.step_timeout *= factor
+                stage.total_timeout *= factor
+            if isinstance(stage, amt.WakeupAMTHosts):
+                stage.poll *= factor
+                stage.timeout *= factor
+            if stage.retry is not None:
+                stage.retry = copy.copy(stage.retry)
+                stage.retry.delay *= factor
+                stage.retry.max_delay *= factor
@@ -1,52 +1,117 @@
-import subprocess
-import os.path
+import functools
+import time
 
+from clients import amt as amt_client
 from clients import config as cfg
+from clients import session
 from common import config, stage
+from util import hosts
 
 
 class DetermineAMTHosts(config.WithConfigURL, stage.SimpleStage):
     'determine AMT hosts'
 
+    side_effects = False
+    retry = stage.Retry(errors=(OSError,))
+    # Names of AMT hosts got at once, pipelined hosts get their own.
+    amt_hosts = {}
+
+    def run(self, state):
+        # Hosts, which failed to get at once, are retried one by one.
+        self.amt_hosts = cfg.get_many(
+            self.config_url,
+            filter(None, (host.props.get('amt')
+                          for host in state.active_hosts)),
+            errors={})
+        super().run(state)
+
     def run_single(self, host):
         amt_host = host.props.get('amt')
         if amt_host is None:
             host.fail(self, 'host props do not have "amt" attribute')
+        elif amt_host in self.amt_hosts:
+            host.amt_host = self.amt_hosts[amt_host]['name']
         else:
             host.amt_host = cfg.get(self.config_url, amt_host)['name']
 
 
 class AMTStage(config.WithAMTCredentials, stage.SimpleStage):
-    def call_amttool(self, host, cmd, special=None):
-        AMTTOOL = os.path.join(os.path.dirname(__file__), os.path.pardir,
-                               'clients', 'amttool')
-        user, passwd = self.amt_creds.get_credentials(host)
-        cmdline = ['/usr/bin/perl', AMTTOOL, host, cmd]
-        if special:
-            cmdline.append(special)
-        return subprocess.check_output(
-            cmdline, env={'AMT_USER': user, 'AMT_PASSWORD': passwd},
-            text=True
-        )
+    # AMT web server is often slow to answer, but only requests it did
+    # not get are sent again, as a reset timed out could still be done.
+    retry = stage.Retry(errors=(session.NotSentError, amt_client.AMTError))
+
+    def credentials(self, host):
+        return self.amt_creds.get_credentials(host.amt_host)
 
 
 class WakeupAMTHosts(AMTStage):
     'wake up hosts via AMT interface'
 
+    limited = True
+    # Hosts powered up are polled every poll seconds until they are on.
+    poll = 5
+    timeout = 120
+
+    def run(self, state):
+        hosts_ = sorted(state.active_hosts)
+        errors = {}
+        states = amt_client.power_states(
+            dict((host.amt_host, self.credentials(host)) for host in hosts_),
+            errors)
+        off = [host for host in hosts_
+               if states.get(host.amt_host, amt_client.S0) != amt_client.S0]
+        if off:
+            state.log.info('powering up {}'.format(hosts.format_hosts(off)))
+        # Slots of the limiter stagger power ups.
+        state.executor.fan_out(
+            functools.partial(self.run_host, fn=self.power_up),
+            state.limiter.interleave(off))
+        # Hosts failed to survey are woken up one by one, meanwhile the
+        # others boot.
+        state.executor.fan_out(
+            self.run_host,
+            [host for host in hosts_ if host.amt_host in errors])
+        self.wait_until_on(
+            [host for host in off if host in state.active_hosts])
+
     def run_single(self, host):
-        try:
-            status = self.call_amttool(host.amt_host, 'powerstate')
-            if status != 0:
-                self.call_amttool(host.amt_host, 'powerup')
-        except Exception:
-            host.fail(self, 'call to amttool failed')
+        state = amt_client.power_state(host.amt_host, self.credentials(host))
+        if state != amt_client.S0:
+            self.power_up(host)
+            self.wait_until_on([host])
+
+    def power_up(self, host):
+        amt_client.remote_control(
+            host.amt_host, self.credentials(host), 'powerup')
+
+    def wait_until_on(self, hosts_):
+        '''Polls power states of hosts together, fails the ones which are
+        not on in time.'''
+        pending = dict((host.amt_host, host) for host in hosts_)
+        deadline = time.monotonic() + self.timeout
+        while pending:
+            states = amt_client.power_states(
+                dict((amt_host, self.credentials(host))
+                     for amt_host, host in pending.items()),
+                errors={})
+            for amt_host, state in states.items():
+                if state == amt_client.S0:
+                    del pending[amt_host]
+            remaining = deadline - time.monotonic()
+            if not pending or remaining <= 0:
+                break
+            time.sleep(min(self.poll, remaining))
+
+        for host in sorted(pending.values()):
+            host.fail(self, 'not powered on in {} seconds'.format(
+                self.timeout))
 
 
 class ResetAMTHosts(AMTStage):
     'reset hosts via AMT interface and boot to PXE'
 
+    limited = True
+
     def run_single(self, host):
-        try:
-            self.call_amttool(host.amt_host, 'reset', 'pxe')
-        except Exception:
-            host.fail(self, 'call to amttool failed')
+        amt_client.remote_control(
+            host.amt_host, self.credentials(host), 'reset', 'pxe')
@@ -5,6 +5,8 @@ from common import config, stage
 class EnsureRedirectionPossible(config.WithAMTRedirdURL, stage.Stage):
     'ensure amtrerid has the hosts required'
 
+    side_effects = False
+
     def run(self, state):
         possible_hosts = set(amtredird.list(self.amtredird_url))
         for host in sorted(state.active_hosts):
@@ -14,9 +16,17 @@ class EnsureRedirectionPossible(config.WithAMTRedirdURL, stage.Stage):
 
 
 class ChangeRedirection(config.WithAMTRedirdURL, stage.Stage):
+    barrier = False
+
     def run(self, state):
+        self.change(sorted(state.active_hosts))
+
+    def run_host(self, host):
+        self.change([host])
+
+    def change(self, selected):
         amt_to_host = {}
-        for host in sorted(state.active_hosts):
+        for host in selected:
             assert host.amt_host
             amt_to_host[host.amt_host] = host
         hosts = list(amt_to_host.keys())
@@ -32,11 +42,17 @@ class EnableRedirection(ChangeRedirection):
     'enable IDE-R redirection via amtredird'
 
     def commands(self):
-        return [amtredird.stop, amtredird.start]
+        return [amtredird.restart]
+
+    def rollback(self, state, hosts):
+        self.stop(state, hosts)
+
+    def rollback_host(self, host):
+        self.stop(host.state, [host])
 
-    def rollback(self, state):
+    def stop(self, state, hosts):
         amt_to_host = {}
-        for host in state.failed_hosts:
+        for host in hosts:
             assert host.amt_host
             amt_to_host[host.amt_host] = host
         results = amtredird.stop(self.amtredird_url, list(amt_to_host.keys()))
@@ -5,20 +5,25 @@ from common import config, host, stage
 class InitHosts(config.WithConfigURL, stage.Stage):
     'get initial host list'
 
+    side_effects = False
+
     def run(self, state):
-        all_hosts = set(cfg.get(self.config_url, sname)['name']
-                        for sname in state.hosts)
+        entities = cfg.get_many(self.config_url,
+                                list(state.hosts) + list(state.groups))
+        all_hosts = set(entities[sname]['name'] for sname in state.hosts)
 
         for group in state.groups:
-            all_hosts |= set(cfg.get(self.config_url, group)['hosts'])
+            all_hosts |= set(entities[group]['hosts'])
 
-        for name in all_hosts:
-            host.Host(state, cfg.get(self.config_url, name))
+        for config_ in cfg.get_many(self.config_url, all_hosts).values():
+            host.Host(state, config_)
 
 
 class ExcludeBannedHosts(config.WithBannedHosts, stage.Stage):
     'exclude banned hosts from deployment'
 
+    side_effects = False
+
     def run(self, state):
         for host_ in sorted(state.active_hosts):
             if any(name in self.banned_hosts
@@ -1,10 +1,13 @@
-from common import config, stage
+from common import config, stage, timing
 from clients import config as cfg
 
 
 class ConfigureBoot(config.WithConfigURL, stage.SimpleStage):
     BOOT_PROP = 'boot'
 
+    # Config service may be unavailable for a moment.
+    retry = stage.Retry(errors=(OSError,))
+
     LOCAL_COW = 'grub.cow'
     COW_MEMORY = 'cow-m'
     DEFAULT = ''
@@ -12,6 +15,54 @@ class ConfigureBoot(config.WithConfigURL, stage.SimpleStage):
     def set(self, host, value):
         cfg.set(self.config_url, host.name, [(ConfigureBoot.BOOT_PROP, value)])
 
+    def set_many(self, values):
+        '''Sets boot of hosts at once, returns errors by host.'''
+        errors = {}
+        names = dict((host.name, host) for host in values)
+        cfg.set_many(
+            self.config_url,
+            dict((host.name, [(ConfigureBoot.BOOT_PROP, value)])
+                 for host, value in values.items()),
+            errors)
+        return dict((names[name], e) for name, e in errors.items())
+
+    def value(self, host):
+        raise NotImplementedError
+
+    def run(self, state):
+        hosts = sorted(state.active_hosts)
+        with timing.measuring() as measurement:
+            failed = self.set_many(dict((host, self.value(host))
+                                        for host in hosts))
+        for host in hosts:
+            if host not in failed:
+                state.timings.add(self, host, measurement)
+
+        # Hosts failed to set at once are retried one by one, the bulk
+        # request being their first attempt.
+        retried = []
+        for host, e in sorted(failed.items()):
+            with state.current_host(host):
+                if not isinstance(e, self.retry.errors) \
+                        or len(host.retries) >= state.retry_budget:
+                    host.fail(self, e)
+                    continue
+                state.log.warning(
+                    'attempt 1 of "{}" failed: {}, retrying'.format(self, e))
+                host.retries.append((str(self), 1, str(e)))
+                retried.append(host)
+        state.executor.fan_out(self.run_host, retried)
+
+    def run_single(self, host):
+        self.set(host, self.value(host))
+
+    def rollback(self, state, hosts):
+        failed = self.set_many(dict((host, ConfigureBoot.DEFAULT)
+                                    for host in hosts))
+        for host, e in sorted(failed.items()):
+            state.log.error('rollback of {} for {} failed: {}'.format(
+                self, host.name, e))
+
     def rollback_single(self, host):
         self.set(host, ConfigureBoot.DEFAULT)
 
@@ -23,29 +74,29 @@ def BootsToLocalLinuxByDefault(host):
 class SetBootIntoCOWMemory(ConfigureBoot):
     'enable boot to COW memory image'
 
-    def run_single(self, host):
-        self.set(host, ConfigureBoot.COW_MEMORY)
+    def value(self, host):
+        return ConfigureBoot.COW_MEMORY
 
 
 class SetBootIntoLocalWindows(ConfigureBoot):
     'enable boot to local Windows'
 
-    def run_single(self, host):
+    def value(self, host):
         windows_partition = (
             host.props.get('windows', {}).get('boot_partition', 'windows10')
         )
-        self.set(host, f'grub.{windows_partition}')
+        return f'grub.{windows_partition}'
 
 
 class SetBootIntoLocalLinux(ConfigureBoot):
     'enable boot to local Linux'
 
-    def run_single(self, host):
-        self.set(host, ConfigureBoot.LOCAL_COW)
+    def value(self, host):
+        return ConfigureBoot.LOCAL_COW
 
 
 class ResetBoot(ConfigureBoot):
     "reset boot into it's default state"
 
-    def run_single(self, host):
-        self.set(host, ConfigureBoot.DEFAULT)
+    def value(self, host):
+        return ConfigureBoot.DEFAULT
@@ -4,6 +4,8 @@ import os
 
 
 class RunCommands(stage.ParallelStage):
+    retry = stage.Retry()
+
     def get_files_to_copy(self, host):
         return []
 
@@ -16,6 +18,8 @@ class RunCommands(stage.ParallelStage):
         rvs += [self.run_ssh(host, cmd, login=self.ssh_login_linux)[0]
                 for cmd in self.get_commands(host)]
 
+        if self.SSH_FAILED in rvs:
+            raise stage.TransientError('ssh failed')
         if any(rvs):
             self.fail('failed to {}'.format(self))
 
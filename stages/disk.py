@@ -7,6 +7,8 @@ class ConfigureDisk(config.WithSSHCredentials, config.WithConfigURL,
                     stage.ParallelStage):
     'call disk.py to configure state of local disk'
 
+    retry = stage.Retry()
+
     def run_single(self, host):
         self.run_ssh_checked(host, ['disk.py', '-c', self.config_url],
                              login=self.ssh_login_linux, description=self)
@@ -17,6 +19,8 @@ class FreeDisk(config.WithSSHCredentials, stage.ParallelStage):
 
     POSSIBLE_MOUNTPOINTS = ['/place']
 
+    retry = stage.Retry()
+
     def run_single(self, host):
         try:
             host.state.log.info(
@@ -51,6 +55,8 @@ class FreeDisk(config.WithSSHCredentials, stage.ParallelStage):
                 login=self.ssh_login_linux,
                 description='deactivate LVM volume groups'
             )
+        except stage.TransientError:
+            raise
         except Exception as e:
             host.state.log.exception('failed to %s', self)
             self.fail(e)
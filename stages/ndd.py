@@ -33,6 +33,9 @@ class RunNDD(config.WithLocalAddress, config.WithNDDArgs, config.WithConfigURL,
              config.WithSSHCredentials, stage.Stage):
     'deploy the images with ndd'
 
+    # Single ndd chain is built for all the hosts at once.
+    barrier = True
+
     @classmethod
     @contextlib.contextmanager
     def prepared_input(cls, input_, iargs, log):
@@ -52,6 +55,9 @@ class RunNDD(config.WithLocalAddress, config.WithNDDArgs, config.WithConfigURL,
         return (host.props.get('switch'), host.name)
 
     def run(self, state):
+        sources = cfg.get_many(
+            self.config_url,
+            (spec.source for spec in self.ndds if spec.source))
         for spec in self.ndds:
             with self.prepared_input(spec.input_, spec.iargs, state.log) \
                     as input_:
@@ -61,8 +67,7 @@ class RunNDD(config.WithLocalAddress, config.WithNDDArgs, config.WithConfigURL,
                 ]
 
                 if spec.source:
-                    remote_source = cfg.get(
-                        self.config_url, spec.source)['name']
+                    remote_source = sources[spec.source]['name']
                     source = '{}@{}'.format(self.get_login(), remote_source)
                 else:
                     cmdline.extend(['--local'])
@@ -10,6 +10,11 @@ class EnsureNetworkSpeed(config.WithLocalAddress,
                          stage.ParallelStage):
     'ensure sufficient throughput of network interface'
 
+    # All the hosts share single iperf server and connection limit.
+    barrier = True
+    resources = ('iperf server',)
+    retry = stage.Retry()
+
     def __init__(self, time=5):
         super().__init__()
         self.time = time
@@ -37,6 +42,8 @@ class EnsureNetworkSpeed(config.WithLocalAddress,
             host,
             ['iperf', '-c', self.local_addr, '-t', str(self.time), '-y', 'c'],
             login=self.ssh_login_linux)
+        if rv == self.SSH_FAILED:
+            raise stage.TransientError('ssh failed')
         if rv != 0:
             self.fail('failed to execute iperf -c, rv is {}'.format(rv))
         else:
@@ -1,6 +1,6 @@
+import asyncio
 import collections
 import datetime
-import time
 
 from . import boot
 from common import config, stage
@@ -33,7 +33,10 @@ CHECK_LINUX_MEM = f'grep -q cowtype=mem /proc/cmdline && {CHECK_LINUX}'
 REBOOT_LINUX = 'touch {} && shutdown -r now'.format(REBOOT_MARKER)
 
 
-class ExecuteRemoteCommands(config.WithSSHCredentials, stage.ParallelStage):
+class ExecuteRemoteCommands(config.WithSSHCredentials,
+                            config.WithSSHParallelism, stage.Stage):
+    barrier = False
+
     def __init__(self, step_timeout, total_timeout):
         super(ExecuteRemoteCommands, self).__init__()
         self.step_timeout = step_timeout
@@ -42,26 +45,57 @@ class ExecuteRemoteCommands(config.WithSSHCredentials, stage.ParallelStage):
     def get_commands(self, host):
         raise NotImplementedError
 
-    def check_result(self, host, command):
-        rv, _ = self.run_ssh(host, command.command,
-                             login=command.login, opts=['ConnectTimeout=5'])
+    async def check_result(self, host, command):
+        rv, _ = await self.run_ssh_async(
+            host, command.command, login=command.login,
+            opts=['ConnectTimeout=5'])
         return rv
 
-    def run_single(self, host):
-        commands = self.get_commands(host)
-        if not commands:
-            return
-
-        start = datetime.datetime.now()
-        while datetime.datetime.now() - start < self.total_timeout:
-            for command in commands:
-                if self.check_result(host, command) == 0:
-                    return
-            host.state.log.info(
-                'condition not met yet, sleeping for {} seconds'.format(
-                    self.step_timeout.seconds))
-            time.sleep(self.step_timeout.seconds)
-        self.fail('failed to execute remote commands')
+    async def execute(self, host, connections):
+        with host.state.current_host(host), \
+                host.state.timings.measure(self, host):
+            commands = self.get_commands(host)
+            if not commands:
+                return True
+
+            async with self.async_slot(host):
+                start = datetime.datetime.now()
+                while datetime.datetime.now() - start < self.total_timeout:
+                    for command in commands:
+                        async with connections:
+                            rv = await self.check_result(host, command)
+                        if rv == 0:
+                            return True
+                    host.state.log.info(
+                        'condition not met yet, sleeping for {} seconds'
+                        .format(self.step_timeout.seconds))
+                    await asyncio.sleep(self.step_timeout.seconds)
+                return False
+
+    async def execute_all(self, hosts):
+        connections = asyncio.Semaphore(self.ssh_connections)
+        results = await asyncio.gather(
+            *(self.execute(host, connections) for host in hosts),
+            return_exceptions=True)
+        return zip(hosts, results)
+
+    def execute_on(self, hosts):
+        for host, result in asyncio.run(self.execute_all(hosts)):
+            # Cancelled commands raise CancelledError, not an Exception.
+            if isinstance(result, BaseException):
+                host.state.log.error(
+                    'Remote commands failed for {}'.format(host),
+                    exc_info=result)
+                host.fail(self, 'exception occured: {}'.format(
+                    str(result) or type(result).__name__))
+            elif not result:
+                host.fail(self, 'failed to execute remote commands')
+
+    def run(self, state):
+        self.execute_on(sorted(state.active_hosts))
+
+    def run_host(self, host):
+        self.execute_on([host])
 
 
 class WaitUntilBootedIntoCOWMemory(ExecuteRemoteCommands):
@@ -89,6 +123,8 @@ class CheckIsAccessible(ExecuteRemoteCommands):
 class RebootHost(ExecuteRemoteCommands):
     'reboot host with SSH, whether Linux or Windows'
 
+    limited = True
+
     def get_commands(self, host):
         return (get_win_commands(host, self.ssh_login_windows, REBOOT_WIN) +
                 [Command(self.ssh_login_linux, [REBOOT_LINUX])])
@@ -97,6 +133,8 @@ class RebootHost(ExecuteRemoteCommands):
 class MaybeRebootLocalLinux(ExecuteRemoteCommands):
     'reboot host booted into local Linux if it is not default boot'
 
+    limited = True
+
     def get_commands(self, host):
         return ([Command(self.ssh_login_linux, [REBOOT_LINUX])]
                 if not boot.BootsToLocalLinuxByDefault(host) else [])
@@ -119,6 +157,8 @@ class WaitUntilBootedIntoLocalLinux(ExecuteRemoteCommands):
 class RebootNonDefaultOS(ExecuteRemoteCommands):
     'reboot non-default OS'
 
+    limited = True
+
     def get_commands(self, host):
         return ([Command(self.ssh_login_linux, [REBOOT_LINUX])]
                 if boot.BootsToWindowsByDefault(host)
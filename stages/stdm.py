@@ -1,7 +1,6 @@
 import html.parser
 import time
 import re
-import requests
 
 from common import config, stage
 
@@ -20,21 +19,31 @@ class StdMStage(config.WithAMTCredentials, stage.ParallelStage):
 
     TIMEOUT = 10
 
+    retry = stage.Retry()
+
     def make_request(self, method, host, url, validate=True, **args):
-        response = method('http://{}:16992/{}'.format(host, url),
-                          auth=requests.auth.HTTPDigestAuth(
-                              *self.amt_creds.get_credentials(host)),
-                          timeout=self.TIMEOUT,
-                          **args)
+        import requests  # Heavy, so only imported once a stage runs.
+        try:
+            response = requests.request(
+                method, 'http://{}:16992/{}'.format(host, url),
+                auth=requests.auth.HTTPDigestAuth(
+                    *self.amt_creds.get_credentials(host)),
+                timeout=self.TIMEOUT,
+                **args)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise stage.TransientError(e) from e
         if validate:
+            if response.status_code >= 500:
+                raise stage.TransientError(
+                    'AMT web server answered {}'.format(response.status_code))
             response.raise_for_status()
         return response
 
     def get(self, host, url):
-        return self.make_request(requests.get, host, url)
+        return self.make_request('GET', host, url)
 
     def post(self, host, url, **params):
-        return self.make_request(requests.post, host, url, validate=True,
+        return self.make_request('POST', host, url, validate=True,
                                  data=params)
 
     def boot_control(self, host, **params):
@@ -46,6 +55,8 @@ class StdMStage(config.WithAMTCredentials, stage.ParallelStage):
 class WakeupStdMHosts(StdMStage):
     'wake up hosts via Std. Manageability interface'
 
+    limited = True
+
     def get_status(self, host, log):
         try:
             response_text = self.get(host, 'remote.htm').text
@@ -88,6 +99,8 @@ class WakeupStdMHosts(StdMStage):
 class ResetStdMHosts(StdMStage):
     'reset hosts via Std. Manageability interface'
 
+    limited = True
+
     def run_single(self, host):
         self.boot_control(
             host.amt_host,
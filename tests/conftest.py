@@ -0,0 +1,59 @@
+import http.server
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def serve():
+    '''Returns a function starting http.server with the handler class
+    given, which returns the URL of the server.'''
+    servers = []
+
+    def start(handler):
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, args=(0.05,),
+                         daemon=True).start()
+        servers.append(server)
+        return 'http://127.0.0.1:{}'.format(server.server_port)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def read_lines(path):
+    with open(path) as input_:
+        return [json.loads(line) for line in input_ if line.strip()]
+
+
+@pytest.fixture
+def simulate(tmp_path):
+    '''Returns a function running main.py against simulated hosts, which
+    returns the exit code, the journal and the simulated calls.'''
+    def run(sim_args, args, journal=None):
+        journal = journal or str(tmp_path / 'journal')
+        record = str(tmp_path / 'record')
+        if os.path.exists(record):
+            os.unlink(record)
+        if '--resume' not in args:
+            args = args + ['--journal', journal]
+        process = subprocess.run(
+            [sys.executable, '-m', 'sim', '--record', record] + sim_args +
+            ['--'] + args,
+            cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, timeout=300)
+        calls = read_lines(record) if os.path.exists(record) else []
+        return process.returncode, read_lines(journal), calls, process.stdout
+
+    return run
@@ -0,0 +1,85 @@
+import socket
+import threading
+import urllib.error
+
+import pytest
+
+from clients import amt
+from sim import amt_server
+from stages import amt as amt_stages
+
+
+@pytest.fixture
+def host(monkeypatch):
+    '''Starts a stand-in AMT host, returns it.'''
+    server = amt_server.Server(('127.0.0.1', 0), 'admin', 'secret',
+                               nonce_uses=2)
+    threading.Thread(target=server.serve_forever, args=(0.05,),
+                     daemon=True).start()
+    monkeypatch.setattr(amt, 'PORT', server.server_port)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+CREDENTIALS = ('admin', 'secret')
+
+
+def test_power_state(host):
+    assert amt.power_state('127.0.0.1', CREDENTIALS) == amt.S5
+
+
+def test_remote_control_powers_up(host):
+    amt.remote_control('127.0.0.1', CREDENTIALS, 'powerup')
+    assert amt.power_state('127.0.0.1', CREDENTIALS) == amt.S0
+    amt.remote_control('127.0.0.1', CREDENTIALS, 'reset', 'pxe')
+    assert host.calls[0] == ('RemoteControl', {
+        'Command': amt.COMMANDS['powerup'],
+        'IanaOemNumber': amt.IANA_OEM_NUMBER})
+    assert host.calls[2][1]['SpecialCommand'] == amt.SPECIAL_COMMANDS['pxe']
+
+
+def test_stale_nonces_are_renewed(host):
+    for _ in range(5):
+        assert amt.power_state('127.0.0.1', CREDENTIALS) == amt.S5
+    assert len(host.calls) == 5
+
+
+def test_wrong_password_is_refused(host):
+    with pytest.raises(urllib.error.HTTPError) as error:
+        amt.power_state('127.0.0.1', ('admin', 'wrong'))
+    assert error.value.code == 401
+    assert not host.calls
+
+
+def test_power_states_at_once(host):
+    errors = {}
+    states = amt.power_states({
+        '127.0.0.1': CREDENTIALS,
+        'localhost': ('admin', 'wrong'),
+    }, errors)
+    assert states == {'127.0.0.1': amt.S5}
+    assert list(errors) == ['localhost']
+
+
+def test_amt_error_describes_status():
+    assert str(amt.AMTError('h', 0x803)) == 'h: invalid command'
+    assert 'unknown' in str(amt.AMTError('h', 0x7777))
+
+
+def test_stages_retry_only_requests_not_sent(monkeypatch):
+    retried = amt_stages.AMTStage.retry.errors
+    # Connections to a socket listening, but not accepting, are made but
+    # never answered; to it closed, refused.
+    listening = socket.socket()
+    listening.bind(('127.0.0.1', 0))
+    listening.listen()
+    monkeypatch.setattr(amt, 'PORT', listening.getsockname()[1])
+    monkeypatch.setattr(amt._session, 'timeout', 0.2)
+    with pytest.raises(urllib.error.URLError) as timeout:
+        amt.remote_control('127.0.0.1', CREDENTIALS, 'reset')
+    assert not isinstance(timeout.value, retried)
+    listening.close()
+    with pytest.raises(urllib.error.URLError) as refused:
+        amt.remote_control('127.0.0.1', CREDENTIALS, 'reset')
+    assert isinstance(refused.value, retried)
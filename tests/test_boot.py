@@ -0,0 +1,39 @@
+import argparse
+import types
+import urllib.error
+
+from clients import config as cfg
+from common import executor, host, stage, state, timing
+from stages import boot
+
+
+def test_boot_set_at_once_is_measured_and_retried_per_host(monkeypatch):
+    sent = []
+
+    def set_many(base_url, props, errors):
+        sent.append(sorted(props))
+        errors['b'] = urllib.error.URLError('unavailable')
+        errors['c'] = ValueError('bad reply')
+
+    monkeypatch.setattr(cfg, 'set_many', set_many)
+    monkeypatch.setattr(cfg, 'set', lambda base_url, entity, props:
+                        sent.append(entity))
+
+    stage_ = boot.SetBootIntoCOWMemory()
+    stage_.config_url = 'http://config'
+    stage_.retry = stage.Retry(errors=(OSError,), delay=0)
+    state_ = state.State(argparse.ArgumentParser(), argparse.Namespace(
+        H=['a', 'b', 'c'], g=[], retry_budget=5))
+    state_.executor = executor.Executor('thread', 0)
+    state_.timings = timing.Timings(types.SimpleNamespace(
+        name='simple', stages=[stage_], indices=[3]))
+    a, b, c = [host.Host(state_, {'name': name}) for name in 'abc']
+
+    stage_.run(state_)
+    assert sent == [['a', 'b', 'c'], 'b']
+    assert state_.active_hosts == {a, b}
+    assert c.failure[0] is stage_ and str(c.failure[1]) == 'bad reply'
+    assert [retry[1:] for retry in b.retries] == [(1, '<urlopen error '
+                                                   'unavailable>')]
+    measured = set(name for _, name in state_.timings.records)
+    assert measured == {'a', 'b'}
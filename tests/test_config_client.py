@@ -0,0 +1,140 @@
+import http.server
+import json
+import time
+import urllib.error
+
+import pytest
+
+from clients import config as cfg
+from clients import session
+
+
+class Entities(http.server.BaseHTTPRequestHandler):
+    '''Config API with ETags, counting the requests by kind.'''
+
+    protocol_version = 'HTTP/1.1'
+    entities = {}
+    requests = []
+    failing = False
+
+    def reply(self, code, body=b'', headers=()):
+        self.send_response(code)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        name = self.path.strip('/')
+        etag = '"{}"'.format(hash(json.dumps(self.entities.get(name))))
+        revalidated = self.headers.get('If-None-Match') == etag
+        self.requests.append((name, revalidated))
+        if self.failing:
+            return self.reply(503)
+        if name not in self.entities:
+            return self.reply(404)
+        if revalidated:
+            return self.reply(304, headers=[('ETag', etag)])
+        self.reply(200, json.dumps(self.entities[name]).encode(),
+                   [('ETag', etag)])
+
+    def do_POST(self):
+        name = self.path.strip('/')
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.requests.append((name, False))
+        self.reply(200, b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api(serve, monkeypatch):
+    handler = type('Handler', (Entities,), {
+        'entities': {
+            'group': {'hosts': ['a.x']},
+            'a.x': {'name': 'a.x', 'props': {'boot': ''}},
+        },
+        'requests': [],
+    })
+    # Retries of the shared session do not wait.
+    monkeypatch.setattr(session, '_session', session.Session(backoff=0))
+    monkeypatch.setattr(cfg, 'cache', None)
+    return serve(handler), handler
+
+
+def test_entities_are_used_within_ttl(api, tmp_path):
+    url, handler = api
+    cfg.use_cache(str(tmp_path), 600)
+    for _ in range(3):
+        assert cfg.get(url, 'group') == {'hosts': ['a.x']}
+    assert handler.requests == [('group', False)]
+    assert cfg.cache.counters['hits'] == 2
+
+
+def test_older_entities_are_revalidated(api, tmp_path):
+    url, handler = api
+    cfg.use_cache(str(tmp_path), 0)
+    cfg.get(url, 'group')
+    assert cfg.get(url, 'group') == {'hosts': ['a.x']}
+    assert handler.requests == [('group', False), ('group', True)]
+    assert cfg.cache.counters['revalidated'] == 1
+
+    handler.entities['group'] = {'hosts': ['b.x']}
+    assert cfg.get(url, 'group') == {'hosts': ['b.x']}
+
+
+def test_stale_entities_are_used_if_api_fails(api, tmp_path):
+    url, handler = api
+    cfg.use_cache(str(tmp_path), 0)
+    cfg.get(url, 'group')
+    handler.failing = True
+    assert cfg.get(url, 'group') == {'hosts': ['a.x']}
+    assert cfg.cache.counters['stale'] == 1
+
+    cfg.cache.max_stale = 0
+    with pytest.raises(urllib.error.HTTPError):
+        cfg.get(url, 'group')
+
+
+def test_hosts_are_always_revalidated(api, tmp_path):
+    url, handler = api
+    cfg.use_cache(str(tmp_path), 600)
+    cfg.get(url, 'a.x')
+    cfg.get(url, 'a.x')
+    assert handler.requests == [('a.x', False), ('a.x', True)]
+
+    handler.failing = True
+    with pytest.raises(urllib.error.HTTPError):
+        cfg.get(url, 'a.x')
+
+
+def test_set_drops_cached_entity(api, tmp_path):
+    url, handler = api
+    cfg.use_cache(str(tmp_path), 600)
+    cfg.get(url, 'group')
+    cfg.set_many(url, {'group': [('boot', 'cow-m')]})
+    cfg.get(url, 'group')
+    assert handler.requests == [('group', False)] * 3
+    assert cfg.cache.counters['invalidated'] == 1
+
+
+def test_get_many_reports_errors_by_entity(api):
+    url, _ = api
+    errors = {}
+    entities = cfg.get_many(url, ['group', 'missing'], errors)
+    assert entities == {'group': {'hosts': ['a.x']}}
+    assert errors['missing'].code == 404
+    with pytest.raises(urllib.error.HTTPError):
+        cfg.get_many(url, ['group', 'missing'])
+
+
+def test_cache_survives_runs(api, tmp_path):
+    url, handler = api
+    cfg.use_cache(str(tmp_path), 600)
+    cfg.get(url, 'group')
+    cfg.cache = cfg.Cache(str(tmp_path), 600)
+    assert cfg.get(url, 'group') == {'hosts': ['a.x']}
+    assert len(handler.requests) == 1
+    assert time.time() - cfg.cache.load(url, 'group')['time'] < 600
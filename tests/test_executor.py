@@ -0,0 +1,56 @@
+import threading
+import time
+import types
+
+import pytest
+
+from common import executor, limits
+
+
+def host(name, switch):
+    return types.SimpleNamespace(name=name, props={'switch': switch})
+
+
+def test_imap_keeps_to_limiter():
+    limiter = limits.Limiter('switch', limit=1)
+    running = set()
+    lock = threading.Lock()
+
+    def call(host_):
+        with lock:
+            assert host_.props['switch'] not in running
+            running.add(host_.props['switch'])
+        time.sleep(0.01)
+        with lock:
+            running.remove(host_.props['switch'])
+        return host_.name
+
+    hosts = [host(str(index), index % 2) for index in range(6)]
+    pool = executor.Executor('thread', 0)
+    try:
+        results = list(pool.imap(call, hosts, limiter=limiter))
+    finally:
+        pool.shutdown()
+    assert sorted(name for _, name in results) == sorted(
+        h.name for h in hosts)
+    assert not +limiter.busy
+
+
+@pytest.mark.parametrize('error', [KeyError, KeyboardInterrupt])
+def test_imap_releases_slots_when_stopped_early(error):
+    limiter = limits.Limiter('switch', limit=1)
+
+    def call(host_):
+        time.sleep(0.05 if host_.name == 'slow' else 0)
+        return host_.name
+
+    pool = executor.Executor('thread', 0)
+    try:
+        with pytest.raises(error):
+            for _ in pool.imap(call, [host('fast', 1), host('slow', 2)],
+                               limiter=limiter):
+                raise error()
+    finally:
+        pool.shutdown()
+    assert not +limiter.busy
+    assert limiter.try_acquire(host('other', 2)) == 0
@@ -0,0 +1,71 @@
+import types
+
+import pytest
+
+from common import journal
+
+
+def method(name='simple', indices=(0, 1, 2, 3)):
+    return types.SimpleNamespace(name=name, indices=list(indices))
+
+
+def host(name):
+    return types.SimpleNamespace(name=name)
+
+
+def test_resume_loads_what_was_recorded(tmp_path):
+    path = str(tmp_path / 'journal')
+    recorded = journal.Journal(path, method())
+    recorded.record(host('a'), 1, journal.DONE)
+    recorded.record(host('a'), 2, journal.DONE)
+    recorded.record(host('b'), 1, journal.DONE)
+    recorded.record(host('b'), 2, journal.FAILED, 'no SSH')
+    recorded.record(host('c'), 1, journal.FAILED, 'no AMT')
+    recorded.record(host('c'), 1, journal.ROLLED_BACK)
+    recorded.close()
+
+    resumed = journal.Journal(path, method(), resume=True)
+    resumed.record(host('a'), 3, journal.DONE)
+    resumed.close()
+    assert resumed.has_finished(host('a'), 2)
+    assert not resumed.has_finished(host('a'), 3)
+    assert resumed.failure(host('a')) is None
+    assert resumed.failure(host('b')) == (2, 'no SSH', False)
+    # Rolled back hosts start over.
+    assert resumed.failure(host('c')) == (1, 'no AMT', True)
+    assert not resumed.has_finished(host('c'), 1)
+
+    again = journal.Journal(path, method(), resume=True)
+    again.close()
+    assert again.has_finished(host('a'), 3)
+
+
+def test_record_cut_by_crash_is_skipped(tmp_path):
+    path = tmp_path / 'journal'
+    recorded = journal.Journal(str(path), method())
+    recorded.record(host('a'), 1, journal.DONE)
+    recorded.close()
+    with open(path, 'a') as output:
+        output.write('{"host": "a", "stage": 2, "ev')
+
+    resumed = journal.Journal(str(path), method(), resume=True)
+    resumed.record(host('a'), 2, journal.DONE)
+    resumed.close()
+    assert resumed.has_finished(host('a'), 1)
+    assert path.read_text().endswith('"event": "done"}\n')
+    assert journal.Journal(str(path), method(), resume=True).has_finished(
+        host('a'), 2)
+
+
+def test_journal_of_other_method_is_refused(tmp_path):
+    path = str(tmp_path / 'journal')
+    journal.Journal(path, method('amt')).close()
+    with pytest.raises(RuntimeError):
+        journal.Journal(path, method('simple'), resume=True)
+
+
+def test_journal_of_other_stages_is_refused(tmp_path):
+    path = str(tmp_path / 'journal')
+    journal.Journal(path, method(indices=[0, 1, 2, 3])).close()
+    with pytest.raises(RuntimeError):
+        journal.Journal(path, method(indices=[0, 2, 3]), resume=True)
@@ -0,0 +1,54 @@
+import time
+import types
+
+from common import limits
+
+
+def host(name, switch=None):
+    props = {} if switch is None else {'switch': switch}
+    return types.SimpleNamespace(name=name, props=props)
+
+
+def test_limit_is_per_key():
+    limiter = limits.Limiter('switch', limit=1)
+    a, b, c = host('a', 's1'), host('b', 's1'), host('c', 's2')
+    assert limiter.try_acquire(a) == 0
+    assert limiter.try_acquire(b) > 0
+    assert limiter.try_acquire(c) == 0
+    limiter.release(a)
+    assert limiter.try_acquire(b) == 0
+
+
+def test_hosts_without_prop_are_not_limited_by_others():
+    limiter = limits.Limiter('switch', limit=1)
+    assert limiter.try_acquire(host('a')) == 0
+    assert limiter.try_acquire(host('b')) == 0
+
+
+def test_slot_is_held_after_release():
+    limiter = limits.Limiter('switch', limit=1, hold=0.2)
+    a, b = host('a', 's1'), host('b', 's1')
+    with limiter.slot(a):
+        pass
+    wait = limiter.try_acquire(b)
+    assert 0 < wait <= 0.2
+    time.sleep(wait)
+    assert limiter.try_acquire(b) == 0
+
+
+def test_rate_spaces_starts():
+    limiter = limits.Limiter('switch', rate=5)
+    assert limiter.try_acquire(host('a', 's1')) == 0
+    wait = limiter.try_acquire(host('b', 's2'))
+    assert 0 < wait <= 0.2
+    start = time.monotonic()
+    with limiter.slot(host('b', 's2')):
+        assert time.monotonic() - start >= wait - 0.01
+
+
+def test_interleave_spreads_keys():
+    limiter = limits.Limiter('switch')
+    hosts = [host('a', 's1'), host('b', 's1'), host('c', 's2'),
+             host('d', 's2'), host('e', 's3')]
+    assert [h.name for h in limiter.interleave(hosts)] == \
+        ['a', 'c', 'e', 'b', 'd']
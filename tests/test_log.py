@@ -0,0 +1,108 @@
+import argparse
+import datetime
+import email
+import gzip
+import io
+import logging
+import os
+import smtplib
+import time
+import zlib
+
+import pytest
+
+from common import log
+
+
+class Collect(logging.Handler):
+    def __init__(self):
+        super(Collect, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def record(message, host=None):
+    result = logging.makeLogRecord({'msg': message})
+    if host is not None:
+        result.host = host
+    return result
+
+
+def test_by_host_groups_records_until_a_stage_boundary():
+    target = Collect()
+    handler = log.ByHost(target)
+    for message, host in [('b1', 'b'), ('a1', 'a'), ('b2', 'b')]:
+        handler.handle(record(message, host))
+    assert target.messages == []
+    handler.handle(record('finished'))
+    assert target.messages == ['a1', 'b1', 'b2', 'finished']
+
+
+def test_by_host_flushes_at_capacity_and_close():
+    target = Collect()
+    handler = log.ByHost(target, capacity=2)
+    for message in ['1', '2', '3']:
+        handler.handle(record(message, 'a'))
+    assert target.messages == ['1', '2']
+    handler.close()
+    assert target.messages == ['1', '2', '3']
+
+
+@pytest.mark.parametrize('limit', [40, 1000, 50000, 10 ** 6])
+@pytest.mark.parametrize('random', [False, True])
+def test_compress_keeps_to_limit(limit, random):
+    data = (os.urandom(300000) if random else
+            b''.join(b'line %d of the log\n' % i for i in range(30000)))
+    output = io.BytesIO()
+    cut = log.compress(io.BytesIO(data), output, limit)
+    assert len(output.getvalue()) <= limit
+    result = zlib.decompress(output.getvalue(), 16 + zlib.MAX_WBITS)
+    assert cut == (result != data)
+    assert data.startswith(result)
+
+
+def test_deliver_archives_from_a_process_of_its_own(tmp_path):
+    log_file = tmp_path / 'log'
+    log_file.write_bytes(b'the log\n' * 1000)
+    args = argparse.Namespace(m='simple', r=None, log_archive=str(tmp_path))
+    start = datetime.datetime.now()
+    log.deliver(args, None, str(log_file), start, start)
+    log_file.unlink()
+
+    for _ in range(100):
+        archived = list(tmp_path.glob('dg_simple_*.log.gz'))
+        try:
+            if archived and gzip.decompress(archived[0].read_bytes()):
+                break
+        except (EOFError, OSError):
+            pass
+        time.sleep(0.05)
+    assert gzip.decompress(archived[0].read_bytes()) == b'the log\n' * 1000
+
+
+def test_send_report_attaches_log_cut(monkeypatch):
+    sent = []
+
+    class SMTP:
+        def __init__(self, host):
+            pass
+
+        def sendmail(self, from_, to, message):
+            sent.append((to, email.message_from_string(message)))
+
+        def quit(self):
+            pass
+
+    monkeypatch.setattr(smtplib, 'SMTP', SMTP)
+    message = {'subject': 'Deployment', 'text': 'Start.\n',
+               'to': ['ops@example.com'], 'limit': 1000}
+    log.send_report(message, io.BytesIO(os.urandom(5000)), '/archive')
+
+    (to, msg), = sent
+    assert to == ['ops@example.com']
+    text, attachment = msg.get_payload()
+    assert 'cut at 1000 bytes' in text.get_payload()
+    assert '/archive' in text.get_payload()
+    assert len(attachment.get_payload(decode=True)) <= 1000
@@ -0,0 +1,29 @@
+import os
+import threading
+
+from util import output
+
+
+def test_writers_share_whole_lines():
+    read, write = os.pipe()
+    path = '/dev/fd/{}'.format(write)
+    first, second = output.opened(path), output.opened(path)
+    assert first is second
+
+    lines = []
+    reader = threading.Thread(
+        target=lambda: lines.extend(os.fdopen(read)))
+    reader.start()
+    writers = [threading.Thread(target=lambda char=char: [
+        first.write(char * 100000 + '\n') for _ in range(20)])
+        for char in 'ab']
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    first.close()
+    second.close()
+    os.close(write)
+    reader.join()
+    assert sorted(lines) == (['a' * 100000 + '\n'] * 20 +
+                             ['b' * 100000 + '\n'] * 20)
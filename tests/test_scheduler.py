@@ -0,0 +1,25 @@
+import contextlib
+import io
+
+import pytest
+
+import main
+from common import scheduler
+
+
+def describe(*args):
+    return scheduler.describe(list(args), main.METHODS)
+
+
+@pytest.mark.parametrize('args, message', [
+    (['-m', 'simple', '-l', 'a'], 'at least one host or group'),
+    (['-m', 'nosuch', '-l', 'a'], "invalid choice: 'nosuch'"),
+    (['-m', 'simple', '-l', 'a', '-h'], 'usage:'),
+])
+def test_describe_raises_without_printing(args, message):
+    stderr, stdout = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stderr(stderr), contextlib.redirect_stdout(
+            stdout):
+        with pytest.raises(ValueError, match=message):
+            describe(*args)
+    assert stderr.getvalue() == stdout.getvalue() == ''
@@ -0,0 +1,192 @@
+import http.server
+import time
+import urllib.error
+
+import pytest
+
+from clients import session
+
+
+class Paths(http.server.BaseHTTPRequestHandler):
+    '''Answers by path: /status/CODE[/LOCATION], /loop redirected to
+    itself, /slow late, /close closing the connection after the reply or
+    /drop closing it instead of replying, counting the requests.'''
+
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    # Number of the first requests of each path failed with 503.
+    failures = 0
+
+    def answer(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        self.requests.append((self.command, self.path, body))
+        tried = sum(1 for _, path, _ in self.requests if path == self.path)
+        code, location = 200, None
+        parts = self.path.split('/', 3)
+        if parts[1] == 'status':
+            code = int(parts[2])
+            location = '/' + parts[3] if len(parts) > 3 else None
+        elif parts[1] == 'loop':
+            code, location = 302, '/loop'
+        elif parts[1] == 'slow':
+            time.sleep(0.5)
+        elif parts[1] in ('close', 'drop'):
+            self.close_connection = True
+            if parts[1] == 'drop':
+                return
+        if tried <= self.failures:
+            code = 503
+        self.send_response(code)
+        if location:
+            self.send_header('Location', location)
+        reply = self.command.encode() + b' ' + body
+        if code == 304:
+            reply = b''
+        else:
+            self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    do_GET = do_POST = answer
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(serve):
+    handler = type('Handler', (Paths,), {'requests': []})
+    return serve(handler), handler
+
+
+def test_connections_are_kept_alive(server):
+    url, handler = server
+    client = session.Session()
+    for _ in range(3):
+        assert client.request(url + '/a') == b'GET '
+    assert client.connections == 1
+    assert client.requests == 3
+
+
+def test_get_is_retried_on_5xx(server):
+    url, handler = server
+    handler.failures = 2
+    client = session.Session(backoff=0)
+    assert client.request(url + '/a') == b'GET '
+    assert len(handler.requests) == 3
+
+
+def test_retries_run_out(server):
+    url, handler = server
+    handler.failures = 10
+    client = session.Session(retries=2, backoff=0)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client.request(url + '/a')
+    assert error.value.code == 503
+    assert len(handler.requests) == 3
+
+
+def test_post_is_not_retried_on_5xx(server):
+    url, handler = server
+    handler.failures = 1
+    client = session.Session(backoff=0)
+    with pytest.raises(urllib.error.HTTPError):
+        client.request(url + '/a', b'x=1')
+    assert len(handler.requests) == 1
+    assert client.request(url + '/b', b'x=1', idempotent=True) == b'POST x=1'
+
+
+def test_4xx_is_not_retried(server):
+    url, handler = server
+    client = session.Session(backoff=0)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client.request(url + '/status/404')
+    assert error.value.code == 404
+    assert len(handler.requests) == 1
+
+
+def test_redirects_are_followed_like_by_urlopen(server):
+    url, handler = server
+    client = session.Session()
+    assert client.request(url + '/status/302/a') == b'GET '
+    # POST goes on as GET after 303, but is not redirected after 307.
+    assert client.request(url + '/status/303/b', b'x=1') == b'GET '
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client.request(url + '/status/307/c', b'x=1')
+    assert error.value.code == 307
+    assert [request[:2] for request in handler.requests] == [
+        ('GET', '/status/302/a'), ('GET', '/a'),
+        ('POST', '/status/303/b'), ('GET', '/b'),
+        ('POST', '/status/307/c')]
+
+
+def test_redirect_loop_ends(server):
+    url, handler = server
+    client = session.Session()
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client.request(url + '/loop')
+    assert error.value.code == 302
+    assert len(handler.requests) == session.Session.MAX_REDIRECTS + 1
+
+
+def test_not_modified_is_returned(server):
+    url, _ = server
+    status, _, body = session.Session().open(url + '/status/304')
+    assert (status, body) == (304, b'')
+
+
+def test_refused_connection_is_retried():
+    client = session.Session(retries=1, backoff=0)
+    with pytest.raises(urllib.error.URLError) as error:
+        client.request('http://127.0.0.1:1/', b'x=1')
+    assert isinstance(error.value, session.NotSentError)
+    assert isinstance(error.value.reason, ConnectionRefusedError)
+    assert client.connections == 2
+
+
+def test_connections_closed_while_idle_are_not_reused(server):
+    url, handler = server
+    client = session.Session(retries=0)
+    assert client.request(url + '/close') == b'GET '
+    time.sleep(0.1)
+    assert client.request(url + '/a', b'x=1') == b'POST x=1'
+    assert client.connections == 2
+
+
+@pytest.mark.parametrize('data, idempotent, sent', [
+    (None, False, 2),
+    (b'x=1', True, 2),
+    (b'x=1', False, 1),
+])
+def test_only_idempotent_requests_are_sent_again(server, data, idempotent,
+                                                 sent):
+    url, handler = server
+    client = session.Session(retries=0)
+    client.request(url + '/a')
+    with pytest.raises(urllib.error.URLError):
+        client.request(url + '/drop', data, idempotent=idempotent)
+    assert sum(1 for _, path, _ in handler.requests
+               if path == '/drop') == sent
+
+
+def test_timeouts_are_not_sent_again(server):
+    url, handler = server
+    client = session.Session(timeout=0.2, retries=0)
+    client.request(url + '/a')
+    with pytest.raises(urllib.error.URLError) as error:
+        client.request(url + '/slow')
+    assert isinstance(error.value.reason, TimeoutError)
+    assert sum(1 for _, path, _ in handler.requests if path == '/slow') == 1
+
+
+def test_at_once_collects_errors():
+    def fail():
+        raise ValueError('no')
+
+    errors = {}
+    results = session.at_once({'a': lambda: 1, 'b': fail}, errors)
+    assert results == {'a': 1}
+    assert str(errors['b']) == 'no'
+    with pytest.raises(ValueError):
+        session.at_once({'a': lambda: 1, 'b': fail})
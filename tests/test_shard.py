@@ -0,0 +1,60 @@
+import collections
+import shlex
+import sys
+
+from common import journal
+from methods import simple
+
+from test_sim import SIMPLE, done, with_side_effects
+
+
+def worker(address):
+    return '{}={} -m sim --hosts 6 --'.format(address, sys.executable)
+
+
+def test_workers_deploy_their_shares(simulate):
+    rv, records, _, output = simulate(
+        ['--hosts', '6'],
+        SIMPLE + ['--shard', worker('127.0.0.2'), '--shard',
+                  worker('127.0.0.3'), '--shard-by', 'none'])
+    assert rv == 0, output
+    stages = done(records)
+    assert len(stages) == 6
+    for name in stages:
+        assert with_side_effects(simple.SimpleMethod) <= stages[name]
+    assert 'starting worker 127.0.0.2' in output
+    assert 'starting worker 127.0.0.3' in output
+
+
+def test_failures_on_workers_come_back(simulate):
+    rv, records, _, output = simulate(
+        ['--hosts', '4'],
+        SIMPLE + ['--shard', '127.0.0.2={} -m sim --hosts 4 --failures '
+                  'ssh=1 --'.format(sys.executable), '--shard-by', 'none',
+                  '--retry-budget', '0'])
+    assert rv == 1, output
+    failed = collections.Counter(record['host'] for record in records
+                                 if record.get('event') == journal.FAILED)
+    assert sorted(failed) == ['sim{:05d}.sim'.format(index)
+                              for index in range(4)]
+
+
+CRASHING = '''
+import json, sys
+sys.stdin.read()
+print(json.dumps({'host': 'sim00000.sim', 'stage': 5, 'event': 'done'}))
+sys.exit(3)
+'''
+
+
+def test_hosts_of_crashed_workers_fail_where_they_stopped(simulate):
+    rv, records, _, output = simulate(
+        ['--hosts', '2'],
+        SIMPLE + ['--shard', '127.0.0.2={} -c {}'.format(
+            sys.executable, shlex.quote(CRASHING)), '--shard-by', 'none'])
+    assert rv == 1, output
+    failed = dict((record['host'], record['stage']) for record in records
+                  if record.get('event') == journal.FAILED)
+    first = min(with_side_effects(simple.SimpleMethod))
+    assert failed == {'sim00000.sim': 6, 'sim00001.sim': first}
+    assert 'worker exited with rv 3' in output
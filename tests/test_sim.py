@@ -0,0 +1,79 @@
+import collections
+
+from common import journal
+from methods import simple
+
+
+SIMPLE = ['-m', 'simple', '-l', '127.0.0.1', '-n', '/dev/null:/dev/null']
+
+
+def done(records):
+    '''Returns stages done by host.'''
+    stages = collections.defaultdict(set)
+    for record in records:
+        if record.get('event') == journal.DONE:
+            stages[record['host']].add(record['stage'])
+    return stages
+
+
+def host_calls(calls, backend):
+    hosts = collections.defaultdict(list)
+    for call in calls:
+        if call['backend'] == backend:
+            hosts[call['host']].append(call['args'])
+    return hosts
+
+
+def with_side_effects(method):
+    return set(index for index, stage in enumerate(method.stages)
+               if stage.side_effects)
+
+
+def test_simple_runs_every_stage_for_every_host(simulate):
+    rv, records, calls, output = simulate(['--hosts', '5', '--seed', '1'],
+                                          SIMPLE)
+    assert rv == 0, output
+    names = ['sim{:05d}.sim'.format(index) for index in range(5)]
+    stages = done(records)
+    for name in names:
+        assert with_side_effects(simple.SimpleMethod) <= stages[name]
+
+    ssh = host_calls(calls, 'ssh')
+    boot = host_calls(calls, 'config')
+    for name in names:
+        assert ['shutdown /r /t 0'] in ssh[name]
+        assert [['boot', 'grub.windows10']] in boot[name]
+    # Every host gets the image from a single ndd run.
+    ndd, = host_calls(calls, 'ndd')[None]
+    assert sorted(ndd[index + 1].split('@')[1] for index, arg
+                  in enumerate(ndd) if arg == '-d') == names
+
+
+def test_resume_skips_stages_done(simulate, tmp_path):
+    rv, records, _, output = simulate(['--hosts', '3'], SIMPLE)
+    assert rv == 0, output
+    path = str(tmp_path / 'journal')
+    rv, records, calls, output = simulate(
+        ['--hosts', '3'], SIMPLE + ['--resume', path], journal=path)
+    assert rv == 0, output
+    # Only the stages without side effects run again.
+    assert not host_calls(calls, 'config')
+    assert all(['shutdown /r /t 0'] not in args
+               for args in host_calls(calls, 'ssh').values())
+    assert len([record for record in records if 'method' in record]) == 2
+
+
+def test_failed_canaries_stop_the_waves(simulate, tmp_path):
+    credentials = tmp_path / 'amtpasswd'
+    credentials.write_text('admin:admin\n')
+    rv, records, calls, output = simulate(
+        ['--hosts', '8', '--failures', 'ssh=1'],
+        ['-m', 'amt', '-l', '127.0.0.1', '-n', '/dev/null:/dev/null',
+         '-p', str(credentials), '--canary', '2', '--retry-budget', '0'])
+    assert rv == 1, output
+    assert 'not deploying the others' in output
+    # Only the canaries got as far as being reset.
+    assert set(host_calls(calls, 'amt')) == {'sim00000-amt.sim',
+                                             'sim00001-amt.sim'}
+    assert set(host_calls(calls, 'config')) == {'sim00000.sim',
+                                                'sim00001.sim'}
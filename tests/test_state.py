@@ -0,0 +1,15 @@
+import argparse
+
+from common import host, state
+
+
+def test_view_sees_failures_in_other_views():
+    state_ = state.State(argparse.ArgumentParser(), argparse.Namespace(
+        H=['a', 'b', 'c'], g=[], retry_budget=0))
+    a, b, c = [host.Host(state_, {'name': name}) for name in 'abc']
+    first, second = state_.view([a, b]), state_.view([b, c])
+
+    b.fail('stage', 'reason')
+    assert first.active_hosts == {a}
+    assert second.active_hosts == {c}
+    assert state_.failed_hosts == {b}
@@ -0,0 +1,26 @@
+import types
+
+from common import timing
+
+
+class Stage(object):
+    def __str__(self):
+        return 'stage'
+
+
+def test_stage_run_in_waves_spans_them():
+    stage = Stage()
+    method = types.SimpleNamespace(name='simple', stages=[stage], indices=[3])
+    timings = timing.Timings(method)
+    hosts = [types.SimpleNamespace(name=name) for name in ('a', 'b')]
+    timings.finished(stage, timing.Measurement(start=10.0, wall=5.0))
+    timings.add(stage, hosts[0], timing.Measurement(start=11.0, wall=2.0))
+    timings.finished(stage, timing.Measurement(start=20.0, wall=4.0))
+    timings.add(stage, hosts[1], timing.Measurement(start=23.0, wall=1.0))
+
+    data = timings.dump(types.SimpleNamespace(
+        active_hosts=set(), all_failed_hosts=set()))
+    (whole,) = data['stages']
+    assert (whole['index'], whole['start'], whole['wall']) == (3, 10.0, 14.0)
+    assert dict((record['host'], record['queue'])
+                for record in data['records']) == {'a': 1.0, 'b': 3.0}
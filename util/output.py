@@ -0,0 +1,49 @@
+import os
+import threading
+
+
+_lock = threading.Lock()
+_opened = {}
+
+
+class Output(object):
+    '''File of lines, which several writers, e.g. the journal and the JSON
+    log both going to /dev/stdout of a worker, share. Each line is written
+    whole, so that lines of the writers do not mix.'''
+
+    def __init__(self, file_name, mode):
+        self.file_name = file_name
+        self.output = open(file_name, mode)
+        self.lock = threading.Lock()
+        self.users = 0
+
+    def write(self, line):
+        with self.lock:
+            self.output.write(line)
+            self.output.flush()
+
+    def flush(self):
+        pass
+
+    def fileno(self):
+        return self.output.fileno()
+
+    def close(self):
+        with _lock:
+            self.users -= 1
+            if self.users:
+                return
+            del _opened[self.file_name]
+        self.output.close()
+
+
+def opened(file_name, mode='a'):
+    '''Returns the output open for file_name, opening it with mode if no
+    other writer has it open. Each call needs a close.'''
+    file_name = os.path.abspath(file_name)
+    with _lock:
+        if file_name not in _opened:
+            _opened[file_name] = Output(file_name, mode)
+        output = _opened[file_name]
+        output.users += 1
+    return output
@@ -1,21 +1,69 @@
+import asyncio
+import contextlib
+import contextvars
+import dataclasses
 import subprocess
+import time
+
+
+@dataclasses.dataclass
+class Account:
+    seconds: float = 0.0
+
+
+_account = contextvars.ContextVar('account', default=None)
+
+
+@contextlib.contextmanager
+def accounted():
+    '''Accounts time spent running subprocesses in current context.'''
+    account = Account()
+    token = _account.set(account)
+    try:
+        yield account
+    finally:
+        _account.reset(token)
+
+
+def charge(start):
+    current = _account.get()
+    if current is not None:
+        current.seconds += time.time() - start
+
+
+def log_stderr(stderr, log):
+    if stderr:
+        for line in stderr.splitlines():
+            log.info('stderr: %s', line)
 
 
 def run_process(args, log, stdout=subprocess.PIPE, stderr=subprocess.PIPE):
     log.info(f'running {args}')
+    start = time.time()
     proc = subprocess.Popen(
         args, stdout=stdout, stderr=stderr, text=True
     )
     stdout, stderr_ = proc.communicate()
-
-    if stderr_:
-        for line in stderr_.splitlines():
-            log.info('stderr: %s', line)
+    charge(start)
+    log_stderr(stderr_, log)
 
     return (proc.returncode, stdout)
 
 
-def run_remote_process(host, login, args, log, opts):
+async def run_process_async(args, log):
+    log.info(f'running {args}')
+    start = time.time()
+    proc = await asyncio.create_subprocess_exec(
+        *args, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    stdout, stderr = await proc.communicate()
+    charge(start)
+    log_stderr(stderr.decode(errors='replace'), log)
+
+    return (proc.returncode, stdout.decode(errors='replace'))
+
+
+def remote_cmdline(host, login, args, opts):
     cmdline = ['ssh', '-l', login,
                '-o', 'PasswordAuthentication=no', '-o', 'BatchMode=yes']
     if opts is not None:
@@ -23,5 +71,13 @@ def run_remote_process(host, login, args, log, opts):
             cmdline.extend(['-o', opt])
     cmdline.append(host)
     cmdline.extend(args)
+    return cmdline
+
+
+def run_remote_process(host, login, args, log, opts):
+    return run_process(remote_cmdline(host, login, args, opts), log)
+
 
-    return run_process(cmdline, log)
+async def run_remote_process_async(host, login, args, log, opts):
+    return await run_process_async(
+        remote_cmdline(host, login, args, opts), log)